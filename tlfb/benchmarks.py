@@ -0,0 +1,213 @@
+import datetime
+import gc
+import platform
+import random
+import subprocess
+import time
+import tracemalloc
+
+from django import forms
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from tlfb.data.drafts import create_days
+from tlfb.data.models import DraftDay
+from tlfb.encrypt_data import get_encrypted_session
+from tlfb.encrypttest import decrip, encrip
+from tlfb.transform_helper import (DAY_COLUMNS, build_transform, get_agg, get_average, get_mg, transform_csv,
+                                   value_converter)
+
+# key table answer used instead of looking the participant up in REDCap
+KEY_DATA = {'cohort': '-1', 'study': ''}
+ENCRYPTION_KEY = '9678365400123890'
+BENCHMARK_PID = 'benchmark'
+
+# answer keys the transform reads, and what participants answer for them
+ANSWER_KEYS = tuple(sorted({source for column, source in DAY_COLUMNS if not callable(source)}))
+ANSWERS = ('1', '2', '3', '4', '5', '10', '1/2', '1/4', '3/4', '0.5 (1/2 gram)', '10 or more', 'Yes', '12 mg')
+UNKNOWN_ANSWERS = ('Unknown', '----', '999')
+
+
+def make_answers(rng, days=30, substances=5, unknown_rate=0.1, start=datetime.date(2020, 1, 1)):
+    """
+    A synthetic submission in the shape ThankYouView saves: days calendar days with up to substances answers each, of
+    which about unknown_rate are "Unknown", "----" or "999".
+    """
+    answers = {}
+    for i in range(days):
+        day = {}
+        for key in rng.sample(ANSWER_KEYS, rng.randint(0, substances)):
+            answer = rng.choice(UNKNOWN_ANSWERS) if rng.random() < unknown_rate else rng.choice(ANSWERS)
+            day[key] = {'label': key, 'answer': answer, 'answer_display': answer}
+        answers[(start + datetime.timedelta(days=i)).isoformat()] = {'markers': [], 'submitted': True,
+                                                                     'substances': day}
+    return answers
+
+
+def make_session(rng, days=30):
+    return {
+        'subid': encrip(ENCRYPTION_KEY, str(rng.randint(10000, 99999)) + 'a'),
+        'timepoint': str(rng.randint(1, 4)),
+        'pid': BENCHMARK_PID,
+        'offset': 0,
+        'cohort': '',
+        'study_cannabis': rng.random() < 0.5,
+        'days': days,
+        'prescription': True,
+        'study_removed': False,
+    }
+
+
+def measure(func, min_time=0.2, repeat=3):
+    """
+    Runs func for at least min_time seconds, repeat times, and returns its best ops/sec with the memory one call
+    allocates at its peak.
+    """
+    number = 1
+    while True:
+        elapsed = time_calls(func, number)
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed <= 0 else max(2, int(min_time / elapsed) + 1)
+    best = min([elapsed] + [time_calls(func, number) for i in range(repeat - 1)])
+
+    tracemalloc.start()
+    func()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'ops_per_sec': round(number / best, 2),
+        'mean_us': round(best / number * 1e6, 2),
+        'peak_allocated_kb': round(peak / 1024, 2),
+        'retained_kb': round(current / 1024, 2),
+    }
+
+
+def time_calls(func, number):
+    gc.collect()
+    started = time.perf_counter()
+    for i in range(number):
+        func()
+    return time.perf_counter() - started
+
+
+def get_benchmarks(seed=0, days=30, substances=5, unknown_rate=0.1):
+    """
+    The benchmarked operations by name, each a function without arguments running over the same synthetic data for a
+    given seed.
+    """
+    rng = random.Random(seed)
+    answers = make_answers(rng, days, substances, unknown_rate)
+    # the get_* helpers aggregate a transform before its summaries are added
+    transform = {k: v for k, v in build_transform('12345', '1', '', '', answers, key_data=KEY_DATA).items()
+                 if not k.startswith('summ_')}
+    raw_answers = [substance['answer'] for day in answers.values() for substance in day['substances'].values()]
+    subids = [str(rng.randint(10000, 99999)) + rng.choice('abcdefghij') for i in range(100)]
+    encrypted = [encrip(ENCRYPTION_KEY, subid) for subid in subids]
+    session = make_session(rng, days)
+
+    return [
+        ('transform_data', lambda: transform_csv(build_transform('12345', '1', '', '', answers, key_data=KEY_DATA))),
+        ('get_agg', lambda: get_agg(transform, ('alc',))),
+        ('get_mg', lambda: get_mg(transform, ('rx_opd',))),
+        ('get_average', lambda: get_average(transform, ('ncan_flw_g', 'scan_flw_g'))),
+        ('value_converter x{}'.format(len(raw_answers)), lambda: [value_converter(raw) for raw in raw_answers]),
+        ('encrip x100', lambda: [encrip(ENCRYPTION_KEY, subid) for subid in subids]),
+        ('decrip x100', lambda: [decrip(ENCRYPTION_KEY, subid) for subid in encrypted]),
+        ('get_encrypted_session', lambda: get_encrypted_session(session, answers)),
+    ]
+
+
+class WizardWalk(object):
+    """
+    Enters one calendar day through the SubstanceWizard with the Django test client, answering every step with
+    answers drawn from the same seed on every walk. Uses BENCHMARK_PID's draft days in the database.
+    """
+
+    def __init__(self, seed=0):
+        self.seed = seed
+        self.date = datetime.date(2020, 1, 1)
+        self.url = reverse('step3') + '?date=' + self.date.isoformat()
+
+    def __enter__(self):
+        # the walk reads the forms from the response context, which is only recorded in a test environment
+        setup_test_environment()
+        DraftDay.objects.filter(pid=BENCHMARK_PID).delete()
+        create_days(BENCHMARK_PID, [self.date])
+        self.client = Client()
+        session = self.client.session
+        session.update(make_session(random.Random(self.seed), days=1))
+        session.save()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.client.logout()  # deletes the walk's session
+        DraftDay.objects.filter(pid=BENCHMARK_PID).delete()
+        teardown_test_environment()
+
+    def __call__(self):
+        rng = random.Random(self.seed)
+        response = self.client.get(self.url)
+        for i in range(100):
+            if response.status_code == 302:
+                return
+            wizard = response.context['wizard']
+            data = {'substance_wizard-current_step': wizard['steps'].current}
+            form = wizard['form']
+            if isinstance(form, forms.BaseFormSet):
+                management_form = form.management_form
+                data.update({management_form.prefix + '-' + name: value
+                             for name, value in management_form.initial.items() if value is not None})
+                for subform in form.forms:
+                    data.update(get_form_data(rng, subform))
+            else:
+                data.update(get_form_data(rng, form))
+            response = self.client.post(self.url, data)
+        raise RuntimeError('The wizard walk did not finish')
+
+
+def get_form_data(rng, form):
+    data = {}
+    for name, field in form.fields.items():
+        key = form.add_prefix(name)
+        if isinstance(field, forms.MultipleChoiceField):
+            values = [value for value, label in field.choices if value != 'none']
+            data[key] = rng.sample(values, min(2, len(values)))
+        elif isinstance(field, forms.ChoiceField):
+            data[key] = rng.choice([value for value, label in field.choices])
+        elif isinstance(field, forms.BooleanField):
+            if rng.random() < 0.5:
+                data[key] = 'on'
+        elif isinstance(field, forms.CharField):
+            data[key] = rng.choice(['1', '2', 'beer'])
+    return data
+
+
+def run_benchmarks(seed=0, days=30, substances=5, unknown_rate=0.1, min_time=0.2, walk=True, only=None):
+    """
+    Runs every benchmark and returns the results with what they were run on, ready to be saved as JSON.
+    """
+    results = {}
+    for name, func in get_benchmarks(seed, days, substances, unknown_rate):
+        if not only or name in only:
+            results[name] = measure(func, min_time)
+    if walk and (not only or 'wizard_walk' in only):
+        with WizardWalk(seed) as walk_day:
+            results['wizard_walk'] = measure(walk_day, min_time)
+
+    return {
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'created': datetime.datetime.now().isoformat(),
+        'parameters': {'seed': seed, 'days': days, 'substances': substances, 'unknown_rate': unknown_rate},
+        'results': results,
+    }
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
@@ -1,49 +1,121 @@
 import logging
-import time
+import os
 
+from django.conf import settings
+from django.conf.urls import url
 from django.contrib import admin
-from django.http import HttpResponse
-from raven.contrib.django.raven_compat.models import client
+from django.core.exceptions import PermissionDenied
+from django.http import FileResponse, Http404, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.html import format_html
 
-from tlfb.data.models import RoughData
-from tlfb.transform_helper import export_transformed_data, transform_data
-from tlfb.encrypttest import decrip
+from tlfb.data.exports import EXPORT_CHUNK_SIZE, EXPORT_FIELDS, as_record, resubmit, start_export_job
+from tlfb.data.models import ExportJob, OutboxEntry, RoughData
+from tlfb.transform_helper import stream_records
 
 LOGGER = logging.getLogger(__name__)
 
 
 @admin.register(RoughData)
 class RoughDataAdmin(admin.ModelAdmin):
-    list_display = ('subid', 'created')
-    actions = ['export_as_csv', 'resubmit_to_redcap']
+    list_display = ('subid', 'timepoint', 'cohort', 'uploaded', 'created')
+    list_filter = ('uploaded',)  # a cohort filter would need a DISTINCT over the whole table on every load
+    search_fields = ('subid',)
+    ordering = ('-pk',)
+    show_full_result_count = False  # counting the whole table gets slow as it grows
+    actions = ['export_as_csv', 'resubmit_to_storage']
+
+    def get_queryset(self, request):
+        # the list never shows the answers, they are only loaded where they are used
+        return super().get_queryset(request).defer('answers', 'transformed')
+
+    def get_search_results(self, request, queryset, search_term):
+        # an exact subid match can use the (subid, timepoint) index, the default icontains search can't
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        return queryset.filter(subid=search_term), False
 
     def export_as_csv(self, request, queryset):
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename=export.csv'
+        if queryset.count() > settings.BACKGROUND_EXPORT_THRESHOLD:
+            return self.start_job(request, ExportJob.CSV, queryset)
 
-        first = True
-        for obj in queryset:
-            if first:
-                response.write(transform_data(subid=obj.subid, timepoint=obj.timepoint, cohort = obj.cohort, data=obj.answers))
-                first = False
-                continue
-            response.writelines(transform_data(subid=obj.subid, timepoint=obj.timepoint, cohort = obj.cohort, data=obj.answers,
-                                                         with_header=False))
+        # stream the rows straight from a server-side cursor so the export never has to fit in memory
+        # undo get_queryset's defer, only() leaves deferred fields out and they'd be loaded a row at a time
+        objs = queryset.defer(None).only(*EXPORT_FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        response = StreamingHttpResponse(stream_records(as_record(obj) for obj in objs), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename=export.csv'
         return response
 
     export_as_csv.short_description = "Export as Redcap-format CSV"
 
     def resubmit_to_storage(self, request, queryset):
-        for obj in queryset:
-            try:
-                output = transform_data(subid=obj.subid,
-                                                  timepoint=obj.timepoint,
-                                                  cohort=obj.cohort,
-                                                  data=obj.answers)
-                uploaded = export_transformed_data(output)
-                LOGGER.info("Uploaded id '{}' to storage. Success: {}".format(obj.subid, uploaded))
-            except:
-                LOGGER.error("Unable to upload id '{}' to storage.".format(obj.subid))
-                client.captureException()
+        total = queryset.count()
+        if total > settings.BACKGROUND_EXPORT_THRESHOLD:
+            return self.start_job(request, ExportJob.RESUBMIT, queryset)
+
+        uploaded, skipped = resubmit(queryset.defer(None))
+        self.message_user(request, "Uploaded {} of {} records to storage, skipped {} without a pid in the outbox."
+                          .format(uploaded, total, skipped))
 
     resubmit_to_storage.short_description = "Resubmit to storage"
+
+    def start_job(self, request, kind, queryset):
+        job = start_export_job(kind, queryset)
+        self.message_user(request, format_html(
+            'Started a background job for {} records, <a href="{}">follow its progress here</a>.',
+            job.total, reverse('admin:data_exportjob_change', args=[job.pk])))
+
+
+@admin.register(OutboxEntry)
+class OutboxEntryAdmin(admin.ModelAdmin):
+    list_display = ('roughdata', 'pid', 'attempts', 'sent', 'created')
+    readonly_fields = ('roughdata', 'pid', 'attempts', 'last_error', 'sent')
+
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'progress', 'uploaded', 'created', 'download')
+    list_filter = ('kind', 'status')
+    fields = ('kind', 'status', 'progress', 'uploaded', 'created', 'modified', 'download', 'error')
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_urls(self):
+        return [
+            url(r'^(?P<pk>\d+)/status/$', self.admin_site.admin_view(self.status_view),
+                name='data_exportjob_status'),
+            url(r'^(?P<pk>\d+)/download/$', self.admin_site.admin_view(self.download_view),
+                name='data_exportjob_download'),
+        ] + super().get_urls()
+
+    def download(self, obj):
+        if not obj.result:
+            return ''
+        return format_html('<a href="{}">{}</a>', reverse('admin:data_exportjob_download', args=[obj.pk]),
+                           os.path.basename(obj.result.name))
+
+    def status_view(self, request, pk):
+        job = self.get_job(request, pk)
+        return JsonResponse({
+            'status': job.status,
+            'processed': job.processed,
+            'total': job.total,
+            'uploaded': job.uploaded,
+            'download': reverse('admin:data_exportjob_download', args=[job.pk]) if job.result else None,
+        })
+
+    def download_view(self, request, pk):
+        job = self.get_job(request, pk)
+        if not job.result:
+            raise Http404('This job has no file to download')
+        return FileResponse(job.result.open('rb'), as_attachment=True, filename=os.path.basename(job.result.name))
+
+    def get_job(self, request, pk):
+        job = get_object_or_404(ExportJob, pk=pk)
+        if not self.has_view_permission(request, job):
+            raise PermissionDenied
+        return job
@@ -0,0 +1,89 @@
+import collections
+import datetime
+
+import dateutil.parser
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from tlfb.data.models import DraftDay
+
+
+def create_days(pid, dates):
+    DraftDay.objects.bulk_create([DraftDay(pid=pid, date=date) for date in dates], ignore_conflicts=True)
+
+
+def delete_days(pid):
+    DraftDay.objects.filter(pid=pid).delete()
+
+
+def purge_days(max_age=None):
+    """
+    Deletes the calendars nobody has changed for max_age seconds (DRAFT_MAX_AGE_SECONDS by default), left behind by
+    logins that were never submitted. Returns how many days were deleted.
+    """
+    max_age = settings.DRAFT_MAX_AGE_SECONDS if max_age is None else max_age
+    cutoff = timezone.now() - datetime.timedelta(seconds=max_age)
+    stale = DraftDay.objects.values('pid').annotate(last_modified=Max('modified')) \
+        .filter(last_modified__lt=cutoff).values('pid')
+    return DraftDay.objects.filter(pid__in=stale).delete()[0]
+
+
+def get_markers(pid):
+    """
+    Returns the participant's calendar in the shape it is submitted in: a dict of ISO dates to the day's markers and,
+    once the day has been entered, its substances.
+    """
+    markers = collections.OrderedDict()
+    for day in DraftDay.objects.filter(pid=pid).order_by('date'):
+        markers[day.date.isoformat()] = {'markers': day.markers}
+        if day.submitted:
+            markers[day.date.isoformat()].update(submitted=True, substances=day.substances)
+    return markers
+
+
+def has_markers(pid):
+    return DraftDay.objects.filter(pid=pid).exists()
+
+
+def get_session_markers(session):
+    # sessions that were started before drafts were kept in the database still carry the whole calendar
+    if 'markers' in session:
+        restore_markers(session.get('pid'), session.pop('markers'))
+    return get_markers(session.get('pid'))
+
+
+def add_marker(pid, date, event):
+    """
+    Adds a memorable event to a day, returns False if the day isn't on the participant's calendar.
+    """
+    with transaction.atomic():
+        day = DraftDay.objects.select_for_update().filter(pid=pid, date=date).first()
+        if not day:
+            return False
+        day.markers.append(event)
+        day.save(update_fields=['markers', 'modified'])
+    return True
+
+
+def save_substances(pid, dates, substances):
+    """
+    Stores the substances entered for one or more days in a single update and returns how many of the days are on the
+    participant's calendar.
+    """
+    return DraftDay.objects.filter(pid=pid, date__in=dates).update(substances=substances, submitted=True,
+                                                                   modified=timezone.now())
+
+
+def restore_markers(pid, markers):
+    """
+    Replaces the participant's calendar, e.g. with the copy kept in the browser after their session timed out.
+    """
+    with transaction.atomic():
+        DraftDay.objects.filter(pid=pid).delete()
+        DraftDay.objects.bulk_create([
+            DraftDay(pid=pid, date=dateutil.parser.parse(date).date(), markers=day.get('markers', []),
+                     substances=day.get('substances'), submitted=bool(day.get('submitted')))
+            for date, day in markers.items()
+        ])
@@ -0,0 +1,135 @@
+import logging
+import tempfile
+import traceback
+
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+from raven.contrib.django.raven_compat.models import client
+
+from tlfb import tasks
+from tlfb.data.models import Delivery, ExportJob, OutboxEntry, RoughData
+from tlfb.data.transforms import get_stored_values
+from tlfb.settings import USE_CELERY
+from tlfb.transform_helper import (build_transform, export_transformed_records, get_output_sha, stream_records,
+                                   transform_csv)
+
+LOGGER = logging.getLogger(__name__)
+
+EXPORT_CHUNK_SIZE = 500  # rows fetched from the database at a time when exporting
+EXPORT_FIELDS = ('subid', 'timepoint', 'cohort', 'answers', 'transformed', 'transform_version')
+
+
+def as_record(obj):
+    return {'subid': obj.subid, 'timepoint': obj.timepoint, 'cohort': obj.cohort, 'data': obj.answers,
+            'values': get_stored_values(obj)}
+
+
+def resubmit(objs):
+    """
+    Uploads RoughData rows to storage in bulk, each under the pid of its outbox entry. Returns how many of them were
+    accepted and how many were skipped because they have no outbox entry to take the pid from.
+    """
+    objs = list(objs)
+    entries = {roughdata_id: (pk, pid) for roughdata_id, pk, pid in OutboxEntry.objects
+               .filter(roughdata_id__in=[obj.pk for obj in objs]).values_list('roughdata_id', 'pk', 'pid')}
+    skipped = [obj for obj in objs if not entries.get(obj.pk, (None, ''))[1]]
+    if skipped:
+        LOGGER.warning("Skipped {} records without a pid in the outbox: {}".format(
+            len(skipped), ', '.join("'{}'".format(obj.subid) for obj in skipped)))
+
+    transformed = []
+    transforms = []
+    for obj in objs:
+        if not entries.get(obj.pk, (None, ''))[1]:
+            continue
+        try:
+            transforms.append(build_transform(pid_number=entries[obj.pk][1], **as_record(obj)))
+            transformed.append(obj)
+        except:
+            LOGGER.error("Unable to transform id '{}'.".format(obj.subid))
+            client.captureException()
+
+    try:
+        uploaded = export_transformed_records(transforms)
+    except:
+        LOGGER.error("Unable to upload {} records to storage.".format(len(transforms)))
+        client.captureException()
+        uploaded = [False] * len(transforms)
+
+    for obj, success in zip(transformed, uploaded):
+        LOGGER.info("Uploaded id '{}' to storage. Success: {}".format(obj.subid, success))
+    delivered = [(obj, transform) for obj, transform, success in zip(transformed, transforms, uploaded) if success]
+    # recorded like the outbox's uploads, so they aren't uploaded again from there
+    with transaction.atomic():
+        Delivery.objects.bulk_create([Delivery(sha=get_output_sha(transform_csv(transform)), roughdata_id=obj.pk)
+                                      for obj, transform in delivered], ignore_conflicts=True)
+        OutboxEntry.objects.filter(pk__in=[entries[obj.pk][0] for obj, transform in delivered], sent__isnull=True) \
+            .update(sent=timezone.now())
+        RoughData.objects.filter(pk__in=[obj.pk for obj, transform in delivered]).update(uploaded=True)
+    return sum(uploaded), len(skipped)
+
+
+def start_export_job(kind, queryset):
+    ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+    job = ExportJob.objects.create(kind=kind, roughdata_ids=ids, total=len(ids))
+    try:
+        if USE_CELERY:
+            tasks.export_job.delay(job.pk)
+        else:
+            run_export_job(job.pk)
+    except Exception as e:
+        LOGGER.error("Unable to start export job {}.".format(job.pk))
+        client.captureException()
+        ExportJob.objects.filter(pk=job.pk).update(status=ExportJob.FAILED, error=str(e))
+    return job
+
+
+def run_export_job(job_id):
+    job = ExportJob.objects.get(pk=job_id)
+    job.status = ExportJob.RUNNING
+    job.processed = 0
+    job.uploaded = 0
+    job.save(update_fields=['status', 'processed', 'uploaded', 'modified'])
+    try:
+        if job.kind == ExportJob.CSV:
+            write_csv(job)
+        else:
+            for count, objs in iter_chunks(job):
+                uploaded, skipped = resubmit(objs)
+                job.uploaded += uploaded
+                save_progress(job, count)
+    except:
+        LOGGER.error("Export job {} failed.".format(job.pk))
+        client.captureException()
+        job.status = ExportJob.FAILED
+        job.error = traceback.format_exc()
+        job.save(update_fields=['status', 'error', 'modified'])
+        return
+
+    job.status = ExportJob.DONE
+    job.save(update_fields=['status', 'result', 'modified'])
+
+
+def write_csv(job):
+    with tempfile.TemporaryFile() as output:
+        with_header = True
+        for count, objs in iter_chunks(job):
+            for line in stream_records((as_record(obj) for obj in objs), with_header=with_header):
+                output.write(line.encode('utf-8'))
+                with_header = False
+            save_progress(job, count)
+        output.seek(0)
+        job.result.save('export-{}.csv'.format(job.pk), File(output), save=False)
+
+
+def iter_chunks(job):
+    # rows deleted since the job was started are skipped but still count towards the progress
+    for start in range(0, len(job.roughdata_ids), EXPORT_CHUNK_SIZE):
+        ids = job.roughdata_ids[start:start + EXPORT_CHUNK_SIZE]
+        yield len(ids), list(RoughData.objects.filter(pk__in=ids).order_by('pk').only(*EXPORT_FIELDS))
+
+
+def save_progress(job, count):
+    job.processed += count
+    job.save(update_fields=['processed', 'uploaded', 'modified'])
@@ -0,0 +1,48 @@
+import dateutil.parser
+
+from tlfb.data.models import DayFact
+from tlfb.transform_helper import DAY_COLUMNS, DAY_FIELDS, MAX_DAYS
+
+FACT_BATCH_SIZE = 1000  # rows per bulk insert
+
+# the per-day columns of the transform that read a single answer, except the ones with names that have nothing to sum
+FACT_FIELDS = tuple((column, read) for (column, source), (names, read) in zip(DAY_COLUMNS, DAY_FIELDS)
+                    if not callable(source) and 'names' not in column)
+UNKNOWN_CODES = {'-9999': -9999, '-8888': -8888}
+
+
+def build_facts(roughdata):
+    """
+    Returns the DayFact rows of a submission, one per day and answered numeric column, read the same way as the
+    transform reads them.
+    """
+    facts = []
+    days = sorted(roughdata.answers)[:MAX_DAYS]
+    for day in days:
+        substances = roughdata.answers[day].get('substances') or {}
+        if not substances:
+            continue
+        date = dateutil.parser.parse(day).date()
+        for variable, read in FACT_FIELDS:
+            value = read(substances)
+            if not value:
+                continue
+            if value in UNKNOWN_CODES:
+                facts.append(DayFact(roughdata=roughdata, date=date, variable=variable, unknown=UNKNOWN_CODES[value]))
+                continue
+            try:
+                facts.append(DayFact(roughdata=roughdata, date=date, variable=variable, value=float(value)))
+            except ValueError:
+                continue
+    return facts
+
+
+def save_facts(roughdatas):
+    """
+    Writes the DayFact rows of many submissions in bulk inserts and returns how many were written.
+    """
+    facts = []
+    for roughdata in roughdatas:
+        facts.extend(build_facts(roughdata))
+    DayFact.objects.bulk_create(facts, batch_size=FACT_BATCH_SIZE)
+    return len(facts)
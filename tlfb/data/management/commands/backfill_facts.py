@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from tlfb.data.exports import EXPORT_CHUNK_SIZE
+from tlfb.data.facts import save_facts
+from tlfb.data.models import DayFact, RoughData
+
+
+class Command(BaseCommand):
+    help = 'Writes the per-day facts of the submissions that were saved before they were kept, or all with --rebuild'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Delete and rewrite the facts of every submission')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE, help='Submissions per bulk insert')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            DayFact.objects.all().delete()
+        ids = list(RoughData.objects.filter(facts__isnull=True).order_by('pk').values_list('pk', flat=True))
+
+        written = 0
+        chunk_size = options['chunk_size']
+        for start in range(0, len(ids), chunk_size):
+            objs = RoughData.objects.filter(pk__in=ids[start:start + chunk_size]).only('answers')
+            written += save_facts(objs)
+            self.stdout.write('{}/{} submissions'.format(min(start + chunk_size, len(ids)), len(ids)))
+        self.stdout.write('Wrote {} facts for {} submissions'.format(written, len(ids)))
@@ -0,0 +1,42 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from tlfb.benchmarks import run_benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Times the submission pipeline on synthetic participants and saves the results as JSON to compare commits'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None, help='File to save the results to')
+        parser.add_argument('--compare', default=None, help='Results saved by an earlier run to compare against')
+        parser.add_argument('--only', nargs='+', default=None, help='Names of the benchmarks to run')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic data')
+        parser.add_argument('--days', type=int, default=30, help='Calendar days per participant')
+        parser.add_argument('--substances', type=int, default=5, help='Most substances answered per day')
+        parser.add_argument('--unknown-rate', type=float, default=0.1, help='Share of unknown/---- answers')
+        parser.add_argument('--min-time', type=float, default=0.2, help='Seconds each benchmark runs for at least')
+        parser.add_argument('--no-walk', action='store_true',
+                            help="Skip the wizard walk, which writes draft days to the database")
+
+    def handle(self, *args, **options):
+        report = run_benchmarks(seed=options['seed'], days=options['days'], substances=options['substances'],
+                                unknown_rate=options['unknown_rate'], min_time=options['min_time'],
+                                walk=not options['no_walk'], only=options['only'])
+        baseline = {}
+        if options['compare']:
+            with open(options['compare']) as previous:
+                baseline = json.load(previous)['results']
+
+        for name, result in report['results'].items():
+            line = '{:<24} {:>12.1f} ops/s {:>12.1f} us {:>10.1f} KB peak'.format(
+                name, result['ops_per_sec'], result['mean_us'], result['peak_allocated_kb'])
+            if name in baseline:
+                line += '  {:.2f}x'.format(result['ops_per_sec'] / baseline[name]['ops_per_sec'])
+            self.stdout.write(line)
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2, sort_keys=True)
+            self.stdout.write('Saved the results of {} to {}'.format(report['commit'] or 'this tree', options['output']))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from tlfb.schema import get_schema_json, get_schema_version
+
+
+class Command(BaseCommand):
+    help = 'Writes the questionnaire schema served at /schema/ as JSON, for renderers that run outside of Django'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None, help='File to write to instead of stdout')
+
+    def handle(self, *args, **options):
+        if options['output']:
+            with open(options['output'], 'wb') as output:
+                output.write(get_schema_json())
+            self.stdout.write('Wrote schema version {} to {}'.format(get_schema_version(), options['output']))
+        else:
+            self.stdout.write(get_schema_json().decode('utf-8'))
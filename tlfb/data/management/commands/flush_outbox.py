@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from tlfb.data.models import OutboxEntry
+from tlfb.data.outbox import flush_outbox
+
+
+class Command(BaseCommand):
+    help = 'Uploads the submissions that are waiting in the outbox, for deployments running without celery'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=None, help='Submissions per bulk upload')
+
+    def handle(self, *args, **options):
+        sent = flush_outbox(chunk_size=options['chunk_size'])
+        pending = OutboxEntry.objects.filter(sent__isnull=True)
+        failed = pending.filter(attempts__gte=settings.OUTBOX_MAX_ATTEMPTS).count()
+        self.stdout.write('Uploaded {} submissions, {} still pending, {} given up on after {} attempts'.format(
+            sent, pending.count() - failed, failed, settings.OUTBOX_MAX_ATTEMPTS))
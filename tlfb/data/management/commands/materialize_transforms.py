@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from tlfb.data.exports import EXPORT_CHUNK_SIZE
+from tlfb.data.models import RoughData
+from tlfb.data.transforms import get_stale, save_transforms
+from tlfb.transform_helper import TRANSFORM_VERSION
+
+
+class Command(BaseCommand):
+    help = 'Stores the transformed values of the submissions that were transformed by older code, or all with --all'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Transform every submission again')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE, help='Submissions per bulk update')
+
+    def handle(self, *args, **options):
+        queryset = RoughData.objects.all() if options['all'] else get_stale()
+        ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+
+        saved = 0
+        chunk_size = options['chunk_size']
+        for start in range(0, len(ids), chunk_size):
+            objs = RoughData.objects.filter(pk__in=ids[start:start + chunk_size]).only('subid', 'answers')
+            saved += save_transforms(objs)
+            self.stdout.write('{}/{} submissions'.format(min(start + chunk_size, len(ids)), len(ids)))
+        self.stdout.write('Transformed {} of {} submissions with version {}'.format(saved, len(ids), TRANSFORM_VERSION))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from tlfb.data.drafts import purge_days
+
+
+class Command(BaseCommand):
+    help = 'Deletes the calendars of logins that were never submitted, for deployments running without celery'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age', type=int, default=None,
+                            help='Seconds since a calendar last changed, DRAFT_MAX_AGE_SECONDS by default')
+
+    def handle(self, *args, **options):
+        deleted = purge_days(max_age=options['max_age'])
+        self.stdout.write('Deleted {} draft days'.format(deleted))
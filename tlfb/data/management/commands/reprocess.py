@@ -0,0 +1,86 @@
+import multiprocessing
+import time
+
+import dateutil.parser
+from django import db
+from django.core.management.base import BaseCommand
+
+from tlfb.data.exports import EXPORT_CHUNK_SIZE
+from tlfb.data.models import RoughData
+from tlfb.data.reprocess import (init_worker, load_checkpoint, remove_checkpoint, reprocess_chunk, save_checkpoint,
+                                 skip_done)
+from tlfb.data.transforms import get_stale
+from tlfb.transform_helper import TRANSFORM_VERSION
+
+
+class Command(BaseCommand):
+    help = 'Transforms submissions again in parallel and optionally resubmits them to storage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cohort', default=None, help='Only submissions of this (encrypted) cohort')
+        parser.add_argument('--timepoint', default=None, help='Only submissions of this timepoint')
+        parser.add_argument('--since', default=None, help='Only submissions created on or after this date')
+        parser.add_argument('--pending', action='store_true', help='Only submissions not uploaded yet')
+        parser.add_argument('--stale', action='store_true', help='Only submissions transformed by older code')
+        parser.add_argument('--upload', action='store_true', help='Resubmit the submissions to storage')
+        parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(), help='Worker processes')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE, help='Submissions per task')
+        parser.add_argument('--checkpoint', default=None,
+                            help='File recording the finished chunks, an interrupted run resumes from it')
+
+    def handle(self, *args, **options):
+        queryset = get_stale() if options['stale'] else RoughData.objects.all()
+        if options['cohort'] is not None:
+            queryset = queryset.filter(cohort=options['cohort'])
+        if options['timepoint'] is not None:
+            queryset = queryset.filter(timepoint=options['timepoint'])
+        if options['since']:
+            queryset = queryset.filter(created__date__gte=dateutil.parser.parse(options['since']).date())
+        if options['pending']:
+            queryset = queryset.filter(uploaded=False)
+
+        # a checkpoint only resumes the same run of the same transform
+        run = {name: options[name] for name in ('cohort', 'timepoint', 'since', 'pending', 'stale', 'upload')}
+        run['version'] = TRANSFORM_VERSION
+        done = load_checkpoint(options['checkpoint'], run)
+        ids = skip_done(queryset.order_by('pk').values_list('pk', flat=True), done)
+        chunk_size = options['chunk_size']
+        tasks = [(ids[start:start + chunk_size], options['upload']) for start in range(0, len(ids), chunk_size)]
+        self.stdout.write('Reprocessing {} submissions in {} chunks with {} workers{}'.format(
+            len(ids), len(tasks), options['workers'], ', resuming from the checkpoint' if done else ''))
+
+        started = time.time()
+        processed = transformed = uploaded = skipped = 0
+        for first, last, count, chunk_transformed, chunk_uploaded, chunk_skipped in self.run(tasks, options['workers']):
+            processed += count
+            transformed += chunk_transformed
+            uploaded += chunk_uploaded
+            skipped += chunk_skipped
+            if options['checkpoint']:
+                done.append([first, last])
+                save_checkpoint(options['checkpoint'], run, done)
+            elapsed = time.time() - started
+            self.stdout.write('{}/{} submissions, {:.1f}/s'.format(processed, len(ids), processed / elapsed))
+
+        # finished, so the next run starts from scratch
+        remove_checkpoint(options['checkpoint'])
+        self.stdout.write('Transformed {} and uploaded {} of {} submissions in {:.1f}s'.format(
+            transformed, uploaded, len(ids), time.time() - started))
+        if skipped:
+            self.stdout.write('Skipped uploading {} submissions without a pid in the outbox'.format(skipped))
+
+    def run(self, tasks, workers):
+        if workers <= 1:
+            for task in tasks:
+                yield reprocess_chunk(task)
+            return
+
+        # the workers are forked, so they must not inherit this process's connection
+        db.connections.close_all()
+        pool = multiprocessing.Pool(workers, initializer=init_worker)
+        try:
+            for result in pool.imap_unordered(reprocess_chunk, tasks):
+                yield result
+        finally:
+            pool.terminate()
+            pool.join()
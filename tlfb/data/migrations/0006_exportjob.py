@@ -0,0 +1,36 @@
+# Generated by Django 2.2.13 on 2026-10-18 08:31
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0005_auto_20211208_0915'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('kind', models.CharField(choices=[('csv', 'Export as Redcap-format CSV'), ('resubmit', 'Resubmit to storage')], max_length=20)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('roughdata_ids', django.contrib.postgres.fields.jsonb.JSONField(default=list)),
+                ('total', models.IntegerField(default=0)),
+                ('processed', models.IntegerField(default=0)),
+                ('uploaded', models.IntegerField(default=0)),
+                ('result', models.FileField(blank=True, upload_to='exports/')),
+                ('error', models.TextField(blank=True)),
+            ],
+            options={
+                'ordering': ('-modified', '-created'),
+                'get_latest_by': 'modified',
+                'abstract': False,
+            },
+        ),
+    ]
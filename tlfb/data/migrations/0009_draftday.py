@@ -0,0 +1,31 @@
+# Generated by Django 2.2.13 on 2026-10-18 08:56
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0008_outboxentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DraftDay',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('pid', models.CharField(max_length=225)),
+                ('date', models.DateField()),
+                ('markers', django.contrib.postgres.fields.jsonb.JSONField(default=list)),
+                ('substances', django.contrib.postgres.fields.jsonb.JSONField(blank=True, null=True)),
+                ('submitted', models.BooleanField(default=False)),
+            ],
+            options={
+                'unique_together': {('pid', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 2.2.13 on 2026-10-18 09:02
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0009_draftday'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='roughdata',
+            index=models.Index(fields=['subid', 'timepoint'], name='roughdata_subid_timepoint_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='roughdata',
+            index=models.Index(fields=['cohort', 'created'], name='roughdata_cohort_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='roughdata',
+            index=models.Index(condition=models.Q(uploaded=False), fields=['created'], name='roughdata_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='roughdata',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['answers'], name='roughdata_answers_gin'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.13 on 2026-10-18 09:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0010_roughdata_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DayFact',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('variable', models.CharField(max_length=50)),
+                ('value', models.FloatField(blank=True, null=True)),
+                ('unknown', models.IntegerField(blank=True, null=True)),
+                ('roughdata', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facts', to='data.RoughData')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='dayfact',
+            index=models.Index(fields=['variable', 'date'], name='dayfact_variable_date_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.13 on 2026-10-18 09:05
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0011_dayfact'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='roughdata',
+            name='transform_version',
+            field=models.CharField(blank=True, max_length=16),
+        ),
+        migrations.AddField(
+            model_name='roughdata',
+            name='transformed',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.13 on 2026-10-18 09:20
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0012_roughdata_transformed'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='draftday',
+            options={'get_latest_by': 'modified', 'ordering': ('-modified', '-created')},
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
 from django_extensions.db.models import TimeStampedModel
 
@@ -11,3 +12,89 @@ class RoughData(TimeStampedModel):
     answers = JSONField()
     uploaded = models.BooleanField(default=False)
     cohort = models.CharField(max_length=100,default='')
+    # per-day columns and summaries of the flat record, see tlfb.data.transforms
+    transformed = JSONField(null=True, blank=True)
+    transform_version = models.CharField(max_length=16, blank=True)
+
+    class Meta(TimeStampedModel.Meta):
+        indexes = [
+            models.Index(fields=['subid', 'timepoint'], name='roughdata_subid_timepoint_idx'),
+            models.Index(fields=['cohort', 'created'], name='roughdata_cohort_created_idx'),
+            # only the few submissions still waiting for storage
+            models.Index(fields=['created'], name='roughdata_pending_idx', condition=models.Q(uploaded=False)),
+            GinIndex(fields=['answers'], name='roughdata_answers_gin'),
+        ]
+
+
+class ExportJob(TimeStampedModel):
+    CSV = 'csv'
+    RESUBMIT = 'resubmit'
+    KIND_CHOICES = (
+        (CSV, 'Export as Redcap-format CSV'),
+        (RESUBMIT, 'Resubmit to storage'),
+    )
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    roughdata_ids = JSONField(default=list)
+    total = models.IntegerField(default=0)
+    processed = models.IntegerField(default=0)
+    uploaded = models.IntegerField(default=0)
+    result = models.FileField(upload_to='exports/', blank=True)
+    error = models.TextField(blank=True)
+
+    @property
+    def progress(self):
+        return '{}/{}'.format(self.processed, self.total)
+
+
+class Delivery(TimeStampedModel):
+    # ledger of the transformed payloads storage has accepted, keyed by the sha1 of the CSV that was sent
+    sha = models.CharField(max_length=40, unique=True)
+    roughdata = models.ForeignKey(RoughData, null=True, blank=True, on_delete=models.SET_NULL)
+
+
+class OutboxEntry(TimeStampedModel):
+    # submissions waiting to be uploaded to storage, written in the same transaction as their RoughData
+    roughdata = models.OneToOneField(RoughData, on_delete=models.CASCADE)
+    pid = models.CharField(max_length=225, blank=True)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    sent = models.DateTimeField(null=True, blank=True)
+
+
+class DraftDay(TimeStampedModel):
+    # a participant's answers for one calendar day while they are taking the survey, see tlfb.data.drafts
+    pid = models.CharField(max_length=225)
+    date = models.DateField()
+    markers = JSONField(default=list)
+    substances = JSONField(null=True, blank=True)
+    submitted = models.BooleanField(default=False)
+
+    class Meta(TimeStampedModel.Meta):
+        unique_together = ('pid', 'date')
+
+
+class DayFact(models.Model):
+    # one numeric answer for one day of a submission, so summaries can be SQL aggregates, see tlfb.data.facts
+    roughdata = models.ForeignKey(RoughData, related_name='facts', on_delete=models.CASCADE)
+    date = models.DateField()
+    variable = models.CharField(max_length=50)  # the REDCap column without its day suffix, e.g. alc_beer_drinks
+    value = models.FloatField(null=True, blank=True)
+    unknown = models.IntegerField(null=True, blank=True)  # -9999 for "Unknown" and -8888 for "----" answers
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['variable', 'date'], name='dayfact_variable_date_idx'),
+        ]
@@ -0,0 +1,111 @@
+import datetime
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from raven.contrib.django.raven_compat.models import client
+
+from tlfb.data.models import Delivery, OutboxEntry, RoughData
+from tlfb.data.transforms import get_stored_values
+from tlfb.transform_helper import build_transform, export_transformed_records, get_output_sha, transform_csv
+
+LOGGER = logging.getLogger(__name__)
+
+
+def flush_outbox(chunk_size=None):
+    """
+    Uploads every pending submission that is due in bulk chunks. Stops at the first chunk that can't reach storage,
+    leaving the rest pending for the next flush. Returns how many submissions were sent.
+    """
+    chunk_size = chunk_size or settings.REDCAP_IMPORT_CHUNK_SIZE
+    now = timezone.now()
+    entries = (OutboxEntry.objects.filter(sent__isnull=True, attempts__lt=settings.OUTBOX_MAX_ATTEMPTS)
+               .order_by('created').values_list('pk', 'attempts', 'modified'))
+    ids = [pk for pk, attempts, modified in entries if is_due(attempts, modified, now)]
+    sent = 0
+    for start in range(0, len(ids), chunk_size):
+        entries = claim_entries(ids[start:start + chunk_size])
+        try:
+            sent += flush_chunk(entries)
+        except Exception as e:
+            LOGGER.warning('Storage is unreachable, {} submissions are still pending'.format(len(ids) - start))
+            client.captureException()
+            # the attempt is already counted, so the chunk backs off like any other failure
+            record_failures([(entry, 'Upload failed: {}'.format(e)) for entry in entries])
+            break
+    return sent
+
+
+def is_due(attempts, modified, now):
+    # entries that failed are retried after a backoff that doubles with every attempt, and never before an upload
+    # claimed at modified could have timed out
+    if not attempts:
+        return True
+    backoff = min(settings.OUTBOX_BACKOFF_SECONDS * 2 ** (attempts - 1), settings.OUTBOX_MAX_BACKOFF_SECONDS)
+    timeout = settings.REDCAP_TIMEOUT * (settings.REDCAP_RETRIES + 1)
+    return modified + datetime.timedelta(seconds=max(backoff, timeout)) <= now
+
+
+def claim_entries(ids):
+    """
+    Counts an attempt for every entry of ids that is still due and returns them. Other flushes skip them until they
+    are due again, so the upload doesn't need to hold their row locks.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        entries = [entry for entry in OutboxEntry.objects.select_for_update(skip_locked=True, of=('self',))
+                   .filter(pk__in=ids, sent__isnull=True).select_related('roughdata')
+                   if is_due(entry.attempts, entry.modified, now)]
+        # update() doesn't touch modified, which the backoff is counted from
+        OutboxEntry.objects.filter(pk__in=[entry.pk for entry in entries]).update(attempts=F('attempts') + 1,
+                                                                                  modified=now)
+    for entry in entries:
+        entry.attempts += 1
+    return entries
+
+
+def flush_chunk(entries):
+    pending = []
+    failed = []
+    for entry in entries:
+        rd = entry.roughdata
+        try:
+            transform = build_transform(subid=rd.subid, timepoint=rd.timepoint, cohort=rd.cohort,
+                                        pid_number=entry.pid, data=rd.answers, values=get_stored_values(rd))
+        except Exception as e:
+            LOGGER.error("Unable to transform id '{}'.".format(rd.subid))
+            client.captureException()
+            failed.append((entry, str(e)))
+            continue
+        pending.append((entry, transform, get_output_sha(transform_csv(transform))))
+
+    delivered = set(Delivery.objects.filter(sha__in=[sha for entry, transform, sha in pending])
+                    .values_list('sha', flat=True))
+    to_send = [(entry, transform, sha) for entry, transform, sha in pending if sha not in delivered]
+    uploaded = export_transformed_records([transform for entry, transform, sha in to_send])
+
+    sent = [entry for entry, transform, sha in pending if sha in delivered]
+    for (entry, transform, sha), success in zip(to_send, uploaded):
+        if success:
+            sent.append(entry)
+        else:
+            failed.append((entry, 'Rejected by storage'))
+
+    with transaction.atomic():
+        Delivery.objects.bulk_create([Delivery(sha=sha, roughdata_id=entry.roughdata_id)
+                                      for (entry, transform, sha), success in zip(to_send, uploaded) if success],
+                                     ignore_conflicts=True)
+        OutboxEntry.objects.filter(pk__in=[entry.pk for entry in sent]).update(sent=timezone.now())
+        RoughData.objects.filter(pk__in=[entry.roughdata_id for entry in sent]).update(uploaded=True)
+        record_failures(failed)
+    return len(sent)
+
+
+def record_failures(failed):
+    for entry, error in failed:
+        OutboxEntry.objects.filter(pk=entry.pk).update(last_error=error)
+        if entry.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+            LOGGER.error("Giving up on uploading id '{}' after {} attempts.".format(entry.roughdata.subid,
+                                                                                 entry.attempts))
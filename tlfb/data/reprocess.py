@@ -0,0 +1,74 @@
+import bisect
+import json
+import os
+
+import django
+from django import db
+
+from tlfb.data.exports import EXPORT_FIELDS, resubmit
+from tlfb.data.models import RoughData
+from tlfb.data.transforms import save_transforms
+
+
+def init_worker():
+    # forked workers must not share the parent's database connection, each opens its own on first use
+    django.setup()
+    db.connections.close_all()
+
+
+def reprocess_chunk(task):
+    """
+    Transforms a chunk of submissions again and, if upload is set, resubmits them to storage. Returns the chunk's
+    first and last pk with how many were transformed, uploaded and skipped for want of a pid.
+    """
+    ids, upload = task
+    objs = list(RoughData.objects.filter(pk__in=ids).order_by('pk').only(*EXPORT_FIELDS))
+    transformed = save_transforms(objs)
+    uploaded, skipped = resubmit(objs) if upload else (0, 0)
+    return ids[0], ids[-1], len(ids), transformed, uploaded, skipped
+
+
+def load_checkpoint(path, run):
+    """
+    Returns the pk ranges of the chunks an interrupted run has done, new submissions always get higher pks so they're
+    never in one. A checkpoint left by a run with other arguments or another TRANSFORM_VERSION is ignored.
+    """
+    if not path or not os.path.exists(path):
+        return []
+    with open(path) as checkpoint:
+        checkpoint = json.load(checkpoint)
+    if checkpoint.get('run') != run:
+        return []
+    return checkpoint['done']
+
+
+def save_checkpoint(path, run, done):
+    # written to a temporary file first so an interrupted run never leaves half a checkpoint
+    with open(path + '.tmp', 'w') as checkpoint:
+        json.dump({'run': run, 'done': done}, checkpoint)
+    os.replace(path + '.tmp', path)
+
+
+def remove_checkpoint(path):
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+def skip_done(ids, done):
+    """
+    The pks of ids outside every done range. The ranges are merged once and each pk is found with a binary search, a
+    resumed run over many chunks would otherwise compare every pk with every range.
+    """
+    merged = []
+    for first, last in sorted(done):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    firsts = [first for first, last in merged]
+    remaining = []
+    for pk in ids:
+        idx = bisect.bisect_right(firsts, pk) - 1
+        if idx < 0 or pk > merged[idx][1]:
+            remaining.append(pk)
+    return remaining
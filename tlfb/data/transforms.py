@@ -0,0 +1,44 @@
+import logging
+
+from raven.contrib.django.raven_compat.models import client
+
+from tlfb.data.models import RoughData
+from tlfb.transform_helper import TRANSFORM_VERSION, get_transform_values
+
+LOGGER = logging.getLogger(__name__)
+
+TRANSFORM_BATCH_SIZE = 500  # rows per bulk update
+
+
+def materialize(roughdata):
+    """
+    Stores the transformed values of a submission on it, without saving. Returns False if it can't be transformed.
+    """
+    try:
+        roughdata.transformed = get_transform_values(roughdata.answers)
+        roughdata.transform_version = TRANSFORM_VERSION
+        return True
+    except:
+        LOGGER.error("Unable to transform id '{}'.".format(roughdata.subid))
+        client.captureException()
+        return False
+
+
+def save_transforms(roughdatas):
+    """
+    Transforms many submissions and saves their values in bulk updates. Returns how many were saved.
+    """
+    objs = [obj for obj in roughdatas if materialize(obj)]
+    RoughData.objects.bulk_update(objs, ['transformed', 'transform_version'], batch_size=TRANSFORM_BATCH_SIZE)
+    return len(objs)
+
+
+def get_stored_values(roughdata):
+    # stored values are only used if they were transformed by the current code
+    if roughdata.transform_version == TRANSFORM_VERSION:
+        return roughdata.transformed
+    return None
+
+
+def get_stale():
+    return RoughData.objects.exclude(transform_version=TRANSFORM_VERSION)
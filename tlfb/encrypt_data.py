@@ -1,13 +1,49 @@
+import base64
+import functools
 import json
+import zlib
+
 from Crypto import Random
 from Crypto.Cipher import AES
 from Crypto.Hash import SHA256
+from Crypto.Util.Padding import pad as pkcs7_pad, unpad as pkcs7_unpad
+from django.conf import settings
+from django.core.cache import cache
 from tlfb.settings import SECRET_KEY
 
+# tokens are "<version>.<payload>", tokens without a version are the original dash separated bytes
+TOKEN_VERSION = "v2"
+
+# the last token a session was encrypted to is kept in the cache under its revision, so it is only rebuilt once the
+# revision has moved on and the session itself stays small
+REVISION_KEY = "revision"
+SNAPSHOT_KEY = "encrypted_session"  # where sessions used to keep the token
+SNAPSHOT_CACHE_KEY = "tlfb:snapshot:{}:{}:{}"
+
+
+def bump_revision(session):
+    """
+    Call after changing anything get_encrypted_session reads: the participant's session or their calendar.
+    """
+    session[REVISION_KEY] = session.get(REVISION_KEY, 0) + 1
 
-def get_encrypted_session(session):
+
+def get_session_snapshot(session, markers):
+    session.pop(SNAPSHOT_KEY, None)
+    if not session.session_key:
+        return get_encrypted_session(session, markers)
+    # another login with the same pid starts over at the same revisions, the session key tells them apart
+    key = SNAPSHOT_CACHE_KEY.format(session["pid"], session.session_key, session.get(REVISION_KEY, 0))
+    token = cache.get(key)
+    if token is None:
+        token = get_encrypted_session(session, markers)
+        cache.set(key, token, timeout=settings.SESSION_EXPIRE_SECONDS)
+    return token
+
+
+def get_encrypted_session(session, markers):
     session_data = {
-        "markers": session["markers"],
+        "markers": markers,
         "subid": session["subid"],
         "timepoint": session["timepoint"],
         "pid": session["pid"],
@@ -18,16 +54,32 @@ def get_encrypted_session(session):
         "prescription": session["prescription"],
         "study_removed": session["study_removed"],
     }
-    encrypted_data = encrypt(json.dumps(session_data))
-    return "-".join([str(byte) for byte in encrypted_data])
+    return encode_token(session_data)
 
 
 def get_decrypted_session(encrypted_data):
+    if "." in encrypted_data:
+        return decode_token(encrypted_data)
     encrypted_data = [int(byte) for byte in encrypted_data.split("-")]
     decrypted_string = decrypt(bytes(encrypted_data))
     return json.loads(decrypted_string)
 
 
+def encode_token(data):
+    # canonical json, compressed, then encrypted and written as url safe base64 without padding
+    message = zlib.compress(json.dumps(data, sort_keys=True, separators=(",", ":")).encode(), 9)
+    payload = base64.urlsafe_b64encode(encrypt_bytes(message)).rstrip(b"=").decode()
+    return TOKEN_VERSION + "." + payload
+
+
+def decode_token(token):
+    version, payload = token.split(".", 1)
+    if version != TOKEN_VERSION:
+        raise ValueError("Unknown session token version {}".format(version))
+    encrypted_data = base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))
+    return json.loads(zlib.decompress(decrypt_bytes(encrypted_data)).decode())
+
+
 def encrypt(message, key=SECRET_KEY):
     key = get_sha(key)
     message = message.encode()
@@ -45,10 +97,24 @@ def decrypt(encrypted_text, key=SECRET_KEY):
     return (original_text.rstrip(b"\0")).decode()
 
 
+def encrypt_bytes(message, key=SECRET_KEY):
+    # unlike encrypt, pads with PKCS7 so messages may end in null bytes
+    iv = Random.new().read(AES.block_size)
+    cipher = AES.new(get_sha(key), AES.MODE_CBC, iv)
+    return iv + cipher.encrypt(pkcs7_pad(message, AES.block_size))
+
+
+def decrypt_bytes(encrypted_data, key=SECRET_KEY):
+    iv = encrypted_data[:AES.block_size]
+    cipher = AES.new(get_sha(key), AES.MODE_CBC, iv)
+    return pkcs7_unpad(cipher.decrypt(encrypted_data[AES.block_size:]), AES.block_size)
+
+
 def pad(message):
     return message + b"\0" * (AES.block_size - len(message) % AES.block_size)
 
 
+@functools.lru_cache(maxsize=None)
 def get_sha(text):
     hasher = SHA256.new(text.encode("utf-8"))
     return hasher.digest()[:16]
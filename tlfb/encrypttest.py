@@ -1,39 +1,41 @@
+import functools
+
 from Crypto.Cipher import DES3
 
 
+@functools.lru_cache(maxsize=None)
+def get_weights(key):
+    #create new encryption cipher
+    des = DES3.new(key, DES3.MODE_ECB)
+
+    #assign each digit a weight and sort, creating a new cipher
+    weight = sorted(des.encrypt('0000000{}'.format(digit).encode("utf8")) + str(digit).encode("utf8")
+                    for digit in range(10))
+    #the digit each position is shifted to, the key only changes with the key so it is derived once
+    return tuple(str(w)[-2] for w in weight)
+
+
+@functools.lru_cache(maxsize=None)
+def get_positions(key):
+    #the reverse of get_weights, the position each digit was shifted from
+    return {digit: str(i) for i, digit in enumerate(get_weights(key))}
+
+
 def decrip(key,input):
+    return decrip_with(get_positions(key), input)
+
+
+def encrip(key,input):
+    return encrip_with(get_weights(key), input)
+
+
+def decrip_with(positions, input):
 
     if len(input) != 8:
         return input
 
-    #create new encryption cipher
-    des = DES3.new(key, DES3.MODE_ECB)
-    weight = []
-
-    #assign each digit a weight]
-    weight.append(des.encrypt('00000000'.encode("utf8"))+b'0')
-    weight.append(des.encrypt('00000001'.encode("utf8"))+b'1')
-    weight.append(des.encrypt('00000002'.encode("utf8"))+b'2')
-    weight.append(des.encrypt('00000003'.encode("utf8"))+b'3')
-    weight.append(des.encrypt('00000004'.encode("utf8"))+b'4')
-    weight.append(des.encrypt('00000005'.encode("utf8"))+b'5')
-    weight.append(des.encrypt('00000006'.encode("utf8"))+b'6')
-    weight.append(des.encrypt('00000007'.encode("utf8"))+b'7')
-    weight.append(des.encrypt('00000008'.encode("utf8"))+b'8')
-    weight.append(des.encrypt('00000009'.encode("utf8"))+b'9')
-    weight.sort()#sort, creating a new cipher
-    midput = []
-    output = []
     #shift digits based on new cipher
-
-
-    for ch in input:
-        i = 0
-        for w in weight:
-            if ch == str(w)[-2]:
-                midput.append(str(i))
-            i += 1
-    midput = ''.join(midput)
+    midput = ''.join(positions.get(ch, '') for ch in input)
     if int(midput[5:8]) > 122:
         letter = chr(int(midput[5:7]))
     else:
@@ -42,25 +44,8 @@ def decrip(key,input):
     return(output)
 
 
-def encrip(key,input):
-    #create new encryption cipher
-    des = DES3.new(key, DES3.MODE_ECB)
-    weight = []
-
-    #assign each digit a weight]
-    weight.append(des.encrypt('00000000'.encode("utf8"))+b'0')
-    weight.append(des.encrypt('00000001'.encode("utf8"))+b'1')
-    weight.append(des.encrypt('00000002'.encode("utf8"))+b'2')
-    weight.append(des.encrypt('00000003'.encode("utf8"))+b'3')
-    weight.append(des.encrypt('00000004'.encode("utf8"))+b'4')
-    weight.append(des.encrypt('00000005'.encode("utf8"))+b'5')
-    weight.append(des.encrypt('00000006'.encode("utf8"))+b'6')
-    weight.append(des.encrypt('00000007'.encode("utf8"))+b'7')
-    weight.append(des.encrypt('00000008'.encode("utf8"))+b'8')
-    weight.append(des.encrypt('00000009'.encode("utf8"))+b'9')
-    weight.sort()#sort, creating a new cipher
+def encrip_with(weights, input):
     midput = []
-    output = []
     #shift digits based on new cipher
     for ch in input:
         if ch.isalpha():
@@ -68,9 +53,6 @@ def encrip(key,input):
         else:
             midput.append(str(ch))
     midput = ''.join(midput)
-    for n in midput:
-        output.append(str(weight[int(n)])[-2])
-    output = ''.join(output)
+    output = ''.join(weights[int(n)] for n in midput)
     output = output[::-1].zfill(8)[::-1]
     return(output)
-
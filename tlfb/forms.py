@@ -1,5 +1,6 @@
 import re
 
+import dateutil.parser
 from bootstrap_datepicker_plus import DatePickerInput
 from django import forms
 from django.core.exceptions import ValidationError
@@ -75,6 +76,23 @@ class MarkerDateForm(forms.Form):
         return self.cleaned_data['date'], self.cleaned_data['event_name']
 
 
+class CopyDayForm(forms.Form):
+    source = forms.ChoiceField(label='Copy the substances entered for')
+    dates = forms.MultipleChoiceField(label='To these days', widget=forms.CheckboxSelectMultiple)
+
+    def __init__(self, *args, **kwargs):
+        markers = self.markers = kwargs.pop('markers')
+        super().__init__(*args, **kwargs)
+
+        # only submitted days can be copied, and only into days that haven't been submitted yet
+        days = [(date, dateutil.parser.parse(date).strftime('%A, %B %d')) for date in sorted(markers)]
+        self.fields['source'].choices = [day for day in days if markers[day[0]].get('submitted')]
+        self.fields['dates'].choices = [day for day in days if not markers[day[0]].get('submitted')]
+
+    def get_substances(self):
+        return self.markers[self.cleaned_data['source']].get('substances', {})
+
+
 class TimeoutForm(forms.Form):
     encrypted_session = forms.CharField(label='encrypted_session', required=True,
                                         widget=forms.HiddenInput(attrs={"id": "encryptedSession"}))
@@ -92,23 +110,45 @@ class DrilldownForm(forms.Form):
         if len(checked) > 1 and 'none' in checked:
             raise ValidationError('Cannot check None and other entries')
 
+    @classmethod
+    def get_show_condition(cls, session):
+        # the (step, option) that has to be checked for this form to be shown, or None if it is never shown
+        return cls.show_condition_step, cls.show_condition_field
+
     @classmethod
     def show(cls, wizard):
-        data = wizard.get_cleaned_data_for_step(cls.show_condition_step) or {}
-        show = cls.show_condition_field in data.get('types') if data else False
-        if show:  # you have to crawl backwards too because drilldowns can be multilevel
-            from tlfb.wizards import FORMS
-            show &= [f[1] for f in FORMS if f[0] == cls.show_condition_step][0].show(wizard)
-        return show
+        # drilldowns can be multilevel, the wizard only asks once show_condition_step is known to be shown
+        condition = cls.get_show_condition(wizard.request.session)
+        if not condition:
+            return False
+        step, field = condition
+        data = wizard.get_cleaned_data_for_step(step) or {}
+        return field in data.get('types') if data else False
+
+
+# every value make_choices can return, so answers can be converted ahead of time (see transform_helper.value_converter)
+CHOICE_VALUES = set()
+
+DEFAULT_OPTIONS = ('----', '1/2 or less', '1', '1 1/2', '2', '2 1/2', '3', '3 1/2', '4', '4 1/2', '5', '6', '7',
+                   '8', '9', '10', '11', '12', '13', '14', '15', '16', '17', '18', '19', '20 or more')
+SINGULAR_OPTIONS = frozenset(['1/4 or less', '3/4', '1/2', '1/2 or less', '1', '1 or less', '1.0'])
+LEGACY_UNITS = re.compile("[\(\[].*?[\)\]]")
+
+# many fields share the same choices, so each distinct list is only built once and shared as a tuple
+_choices = {}
 
 
 def make_choices(singular, plural, options=None):
-    if not options:
-        options = ['----', '1/2 or less', '1', '1 1/2', '2', '2 1/2', '3', '3 1/2', '4', '4 1/2', '5', '6', '7',
-                   '8', '9', '10', '11', '12', '13', '14', '15', '16', '17', '18', '19', '20 or more']
+    key = (singular, plural, tuple(options or DEFAULT_OPTIONS))
+    if key not in _choices:
+        _choices[key] = build_choices(*key)
+    return _choices[key]
+
+
+def build_choices(singular, plural, options):
     tuples = []
     for option in options:
-        pluralize = plural if option not in ['1/4 or less', '3/4', '1/2', '1/2 or less', '1', '1 or less', '1.0'] else singular
+        pluralize = plural if option not in SINGULAR_OPTIONS else singular
         # Make these numeric
         value = '-8888' if option in ['----'] else option
         value = '-9999' if value in ['Unknown'] else value
@@ -118,11 +158,16 @@ def make_choices(singular, plural, options=None):
         value = value.replace('or more', '')
         value = value.replace('or less', '')
         value = value.replace(' ', '')
-        value = re.sub("[\(\[].*?[\)\]]", "", value)
+        value = LEGACY_UNITS.sub("", value)
         tuples.append(
             (value, option + ' {}'.format(pluralize) if option != '----' else option)
         )
-    return tuples
+    CHOICE_VALUES.update(value for value, label in tuples)
+    return tuple(tuples)
+
+
+def remove_options(options, *names):
+    return tuple(option for option in options if option[0] not in names)
 
 
 class SubstanceDetailForm(forms.Form):
@@ -141,17 +186,31 @@ class SubstanceDetailForm(forms.Form):
                     'label': self.fields[field].label
                 }
                 if hasattr(self.fields[field], 'choices'):
-                    nonzero_answers[field]['answer_display'] = dict(self.fields[field].choices)[value]
+                    nonzero_answers[field]['answer_display'] = self.get_choice_displays()[field][value]
         return nonzero_answers
 
+    @classmethod
+    def get_choice_displays(cls):
+        # the choices of detail forms never change per instance, so their value -> display maps are built once
+        if '_choice_displays' not in cls.__dict__:
+            cls._choice_displays = {name: dict(field.choices) for name, field in cls.base_fields.items()
+                                    if hasattr(field, 'choices')}
+        return cls._choice_displays
+
+    @classmethod
+    def get_show_condition(cls, session):
+        # the (step, option) that has to be checked for this form to be shown, or None if it is never shown
+        return cls.show_condition_step, cls.show_condition_field
+
     @classmethod
     def show(cls, wizard):
-        data = wizard.get_cleaned_data_for_step(cls.show_condition_step) or {}
-        show = cls.show_condition_field in data.get('types') if data else False
-        if show:  # you have to crawl backwards too because drilldowns can be multilevel
-            from tlfb.wizards import FORMS
-            show &= [f[1] for f in FORMS if f[0] == cls.show_condition_step][0].show(wizard)
-        return show
+        # drilldowns can be multilevel, the wizard only asks once show_condition_step is known to be shown
+        condition = cls.get_show_condition(wizard.request.session)
+        if not condition:
+            return False
+        step, field = condition
+        data = wizard.get_cleaned_data_for_step(step) or {}
+        return field in data.get('types') if data else False
 
 
 # ##### CONCRETE DRILLDOWN AND DETAIL FORMS #####
@@ -173,6 +232,14 @@ class SubstanceDrilldownForm(DrilldownForm):
     types = forms.MultipleChoiceField(widget=forms.CheckboxSelectMultiple,
                                       choices=OPTIONS)
 
+    # the options shown for each (study removed, prescription removed)
+    OPTION_VARIANTS = {
+        (False, False): remove_options(OPTIONS, 'cannabis-studyremoved'),
+        (True, False): remove_options(OPTIONS, 'cannabis'),
+        (False, True): remove_options(OPTIONS, 'cannabis-studyremoved', 'prescription-drugs'),
+        (True, True): remove_options(OPTIONS, 'cannabis', 'prescription-drugs'),
+    }
+
     def __init__(self, *args, **kwargs):
         remove_prescription2 = kwargs.pop('prescription2')
         keep_prescription = kwargs.pop('prescription')
@@ -180,17 +247,12 @@ class SubstanceDrilldownForm(DrilldownForm):
 
         super().__init__(*args, **kwargs)
 
-        import copy
-        temp_options = copy.deepcopy(self.OPTIONS)
-        if remove_study:
-            temp_options.remove(temp_options[2])
-        else:
-            temp_options.remove(temp_options[3])
-
-        if not keep_prescription and remove_prescription2:
-            temp_options.remove(temp_options[3])
+        remove_prescription = not keep_prescription and remove_prescription2
+        self.fields['types'].choices = self.OPTION_VARIANTS[(bool(remove_study), bool(remove_prescription))]
 
-        self.fields['types'].choices = temp_options
+    @classmethod
+    def get_show_condition(cls, session):
+        return '', ''  # no condition step, this one is always shown
 
     @classmethod
     def show(cls, wizard):
@@ -371,12 +433,11 @@ class CannabisDrilldownForm(DrilldownForm):
     )
 
     @classmethod
-    def show(cls, wizard):
+    def get_show_condition(cls, session):
         # special impl because of the potential to use the GET param to enable/disable study options
-        data = wizard.get_cleaned_data_for_step('substance-drilldown') or {}
-        if wizard.request.session.get('study_cannabis'):
-            return 'cannabis' in data.get('types') if data else False
-        return False
+        if session.get('study_cannabis'):
+            return 'substance-drilldown', 'cannabis'
+        return None
 
 
 class StudyCannabisDrilldownForm(DrilldownForm):
@@ -469,14 +530,12 @@ class NonStudyCannabisDrilldownForm(DrilldownForm):
     )
 
     @classmethod
-    def show(cls, wizard):
+    def get_show_condition(cls, session):
         # special impl because of the potential to use the GET param to enable/disable study options
-        if wizard.request.session.get('study_cannabis'):
-            data = wizard.get_cleaned_data_for_step('cannabis-drilldown') or {}
-            return 'cannabis-non-study' in data.get('types') if data else False
+        if session.get('study_cannabis'):
+            return 'cannabis-drilldown', 'cannabis-non-study'
         else:
-            data = wizard.get_cleaned_data_for_step('substance-drilldown') or {}
-            return 'cannabis' in data.get('types') if data else False
+            return 'substance-drilldown', 'cannabis'
 
 
 class NonStudyCannabisFlowerDetailForm(SubstanceDetailForm):
@@ -625,11 +684,11 @@ class StudyRemovedCannabisDrilldownForm(DrilldownForm):
     )
 
     @classmethod
-    def show(cls, wizard):
+    def get_show_condition(cls, session):
         # special impl because of the potential to use the GET param to enable/disable study options
-        if wizard.request.session.get('study_removed'):
-            data = wizard.get_cleaned_data_for_step('substance-drilldown') or {}
-            return 'cannabis-studyremoved' in data.get('types') if data else False
+        if session.get('study_removed'):
+            return 'substance-drilldown', 'cannabis-studyremoved'
+        return None
 
 class StudyRemovedCannabisFlowerDetailForm(SubstanceDetailForm):
     name = 'Cannabis - Flower'
@@ -1601,3 +1660,4 @@ OtherDetailFormSet.name = 'What type of other substances did you use?'
 OtherDetailFormSet.show_condition_step = 'substance-drilldown'
 OtherDetailFormSet.show_condition_field = 'other'
 OtherDetailFormSet.show = OtherDetailForm.show
+OtherDetailFormSet.get_show_condition = OtherDetailForm.get_show_condition
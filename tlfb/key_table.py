@@ -0,0 +1,104 @@
+import logging
+import os
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from raven.contrib.django.raven_compat.models import client
+from redcap import Project
+
+LOGGER = logging.getLogger(__name__)
+
+# TODO: change these to the names of the subject id and timepoint fields in your REDCap key table
+SUBID_FIELD = 'subid'
+TIMEPOINT_FIELD = 'timepoint'
+
+TABLE_CACHE_KEY = 'tlfb:key_table'
+VERSION_CACHE_KEY = 'tlfb:key_table:version'
+REFRESH_LOCK_CACHE_KEY = 'tlfb:key_table:refresh'
+REFRESH_LOCK_SECONDS = 60
+
+# this process' copy of the key table, indexed by (subid, timepoint)
+_index = {'version': None, 'records': {}}
+
+
+class KeyTableUnavailable(Exception):
+    pass
+
+
+def get_key_record(subid, timepoint):
+    """
+    Returns the key table record for a subject at a timepoint, or None if they aren't in the key table.
+    """
+    return get_key_index().get((str(subid), str(timepoint)))
+
+
+def get_key_index():
+    """
+    The downloaded key table is shared by every web and worker process through the cache. It is kept without an
+    expiry so that the last good copy can still be served while REDCap is down; the version key tells when it was
+    downloaded so it can be refreshed every KEY_TABLE_CACHE_SECONDS.
+    """
+    version = cache.get(VERSION_CACHE_KEY)
+    if version is None or is_stale(version):
+        # only skip the refresh lock when there is no usable copy at all (e.g. a cold or unreachable cache)
+        force = version is None and (_index['version'] is None or is_stale(_index['version']))
+        table = refresh_key_table(force=force)
+        if table is not None:
+            return load_index(table)
+
+    if _index['version'] is None or (version is not None and version != _index['version']):
+        table = cache.get(TABLE_CACHE_KEY)
+        if table is not None:
+            load_index(table)
+
+    if _index['version'] is None:
+        raise KeyTableUnavailable('No copy of the key table is available')
+    return _index['records']
+
+
+def refresh_key_table(force=False):
+    """
+    Downloads the key table from REDCap into the cache. Returns None if another process is already refreshing it or
+    if REDCap can't be reached, in which case any cached copy keeps being used.
+    """
+    if not force and not cache.add(REFRESH_LOCK_CACHE_KEY, True, timeout=REFRESH_LOCK_SECONDS):
+        return None
+
+    try:
+        records = export_key_table()
+    except:
+        # the lock is left to expire so REDCap isn't retried on every request while it is down
+        LOGGER.warning('Unable to download the key table from REDCap')
+        client.captureException()
+        return None
+
+    table = {'version': time.time(), 'records': records}
+    cache.set_many({TABLE_CACHE_KEY: table, VERSION_CACHE_KEY: table['version']}, timeout=None)
+    cache.delete(REFRESH_LOCK_CACHE_KEY)
+    return table
+
+
+def invalidate_key_table():
+    """
+    Forces the next lookup in any process to download the key table again. The current copy is kept as a fallback.
+    """
+    cache.delete(VERSION_CACHE_KEY)
+
+
+def export_key_table():
+    key_table_project = Project(os.getenv('API_URL'), os.getenv('COHORT_KEY_TABLE_TOKEN'))
+    return key_table_project.export_records()
+
+
+def load_index(table):
+    if table['version'] != _index['version']:
+        records = {}
+        for record in table['records']:
+            records[(str(record.get(SUBID_FIELD)), str(record.get(TIMEPOINT_FIELD)))] = record
+        _index.update(version=table['version'], records=records)
+    return _index['records']
+
+
+def is_stale(version):
+    return time.time() - version > settings.KEY_TABLE_CACHE_SECONDS
@@ -0,0 +1,104 @@
+import hashlib
+import json
+
+from django.forms import BaseFormSet, BooleanField, ChoiceField, MultipleChoiceField
+from django.forms.utils import pretty_name
+
+from tlfb.forms import DrilldownForm
+from tlfb.wizards import FORMS, get_step_kwargs
+
+# the schema only depends on the code, so it is built once per process
+_schema = {}
+
+
+def get_schema():
+    """
+    Describes every step of FORMS: the step and option it drills down from, and its fields with their labels and
+    choices. version is a hash of the steps, so it only changes when the forms do.
+    """
+    if not _schema:
+        steps = [describe_step(form_key, form_class) for form_key, form_class in FORMS]
+        version = hashlib.sha256(dump_json(steps)).hexdigest()[:16]
+        _schema['document'] = {'version': version, 'steps': steps}
+        _schema['content'] = dump_json(_schema['document'])
+    return _schema['document']
+
+
+def get_schema_version():
+    return get_schema()['version']
+
+
+def get_schema_json():
+    get_schema()
+    return _schema['content']
+
+
+def dump_json(data):
+    # canonical, so the same forms always give the same bytes and hash
+    return json.dumps(data, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def describe_step(form_key, form_class):
+    formset = issubclass(form_class, BaseFormSet)
+    if formset:
+        kind = 'formset'
+    elif issubclass(form_class, DrilldownForm):
+        kind = 'drilldown'
+    else:
+        kind = 'detail'
+
+    fields = form_class.form.base_fields if formset else form_class.base_fields
+    return {
+        'step': form_key,
+        'name': str(getattr(form_class, 'name', '')),
+        'parent': form_class.show_condition_step,
+        'option': form_class.show_condition_field,
+        'kind': kind,
+        'fields': [describe_field(name, field) for name, field in fields.items()],
+    }
+
+
+def describe_field(name, field):
+    if isinstance(field, MultipleChoiceField):
+        field_type = 'multiple'
+    elif isinstance(field, ChoiceField):
+        field_type = 'choice'
+    elif isinstance(field, BooleanField):
+        field_type = 'boolean'
+    else:
+        field_type = 'text'
+
+    description = {
+        'name': name,
+        'type': field_type,
+        'label': str(field.label or pretty_name(name)),
+        'help_text': str(field.help_text),
+        'required': field.required,
+        'placeholder': field.widget.attrs.get('placeholder', ''),
+    }
+    if hasattr(field, 'choices'):
+        description['choices'] = describe_choices(field.choices)
+    return description
+
+
+def describe_choices(choices):
+    return [[value, str(label)] for value, label in choices]
+
+
+def get_session_overrides(session):
+    """
+    The parts of the schema that depend on the participant's session: the show conditions of the study specific steps
+    and the options of the forms that are built from the session.
+    """
+    overrides = {'conditions': {}, 'choices': {}}
+    for form_key, form_class in FORMS:
+        condition = form_class.get_show_condition(session)
+        if condition != (form_class.show_condition_step, form_class.show_condition_field):
+            overrides['conditions'][form_key] = condition
+
+        kwargs = get_step_kwargs(session, form_key)
+        if kwargs:
+            form = form_class(**kwargs)
+            overrides['choices'][form_key] = {name: describe_choices(field.choices)
+                                              for name, field in form.fields.items() if hasattr(field, 'choices')}
+    return overrides
@@ -0,0 +1,103 @@
+import logging
+
+from django.conf import settings
+from django.contrib.sessions.backends import db
+from django.contrib.sessions.backends.base import CreateError
+from django.contrib.sessions.backends.cache import SessionStore as CacheSessionStore
+
+LOGGER = logging.getLogger(__name__)
+
+
+class SessionStore(CacheSessionStore):
+    """
+    Session engine that keeps sessions in redis (the SESSION_CACHE_ALIAS cache). While redis can't be reached sessions
+    are read from and written to the database instead, and they move back to redis on their next save once it is up.
+    """
+
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        self.in_db = False
+
+    def load(self):
+        try:
+            session_data = self._cache.get(self.cache_key)
+        except Exception:
+            LOGGER.warning('Unable to load the session from redis, trying the database')
+            return self.load_from_db()
+
+        if session_data is not None:
+            return session_data
+        # it may have been saved while redis was down
+        return self.load_from_db()
+
+    def load_from_db(self):
+        store = db.SessionStore(self.session_key)
+        session_data = store.load()
+        self._session_key = store.session_key  # None if it isn't there either
+        self.in_db = self._session_key is not None
+        return session_data
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+
+        data = self._get_session(no_load=must_create)
+        try:
+            if must_create:
+                saved = self._cache.add(self.cache_key, data, self.get_expiry_age())
+            else:
+                self._cache.set(self.cache_key, data, self.get_expiry_age())
+                saved = True
+        except Exception:
+            LOGGER.warning('Unable to save the session to redis, saving it to the database')
+            return self.save_to_db(data, must_create)
+
+        if not saved:
+            raise CreateError
+        if self.in_db:
+            # it's back in redis, so the database copy would only be stale
+            db.SessionStore().delete(self.session_key)
+            self.in_db = False
+
+    def save_to_db(self, data, must_create=False):
+        store = db.SessionStore(self.session_key)
+        store._session_cache = data
+        try:
+            store.save(must_create=True)
+        except CreateError:
+            if must_create:
+                raise
+            store.save()
+        self.in_db = True
+
+    def exists(self, session_key):
+        try:
+            if super().exists(session_key):
+                return True
+        except Exception:
+            LOGGER.warning('Unable to reach redis, checking the session in the database')
+        return db.SessionStore().exists(session_key)
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        try:
+            self._cache.delete(self.cache_key_prefix + session_key)
+        except Exception:
+            LOGGER.warning('Unable to delete the session from redis')
+            db.SessionStore().delete(session_key)
+            return
+        if self.in_db:
+            db.SessionStore().delete(session_key)
+
+    def get_expiry_age(self, **kwargs):
+        # sessions time out after SESSION_EXPIRE_SECONDS of inactivity (see SessionTimeoutMiddleware), redis only has
+        # to keep them long enough after that to show the timeout page
+        return min(super().get_expiry_age(**kwargs), settings.SESSION_CACHE_SECONDS)
+
+    @classmethod
+    def clear_expired(cls):
+        # redis expires its keys itself, only the sessions saved while it was down need clearing
+        db.SessionStore.clear_expired()
@@ -13,6 +13,8 @@ ALLOWED_HOSTS = '*'
 
 DEBUG = os.getenv('DJANGO_DEBUG', 'True') == 'True'
 USE_CELERY = os.getenv('DJANGO_USE_CELERY', 'True') == 'True'
+# enter each calendar day on a single page (see views.DayEntryView) instead of through the step by step wizard
+SINGLE_PAGE_ENTRY = os.getenv('DJANGO_SINGLE_PAGE_ENTRY', 'False') == 'True'
 
 TIME_ZONE = 'UTC'
 LANGUAGE_CODE = 'en-us'
@@ -71,6 +73,64 @@ SESSION_EXPIRE_SECONDS = 5400
 SESSION_EXPIRE_AFTER_LAST_ACTIVITY = True
 SESSION_TIMEOUT_REDIRECT = '/timeout/'
 
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://')
+USE_REDIS_CACHE = os.getenv('DJANGO_USE_REDIS_CACHE', 'False') == 'True'
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+if USE_REDIS_CACHE:
+    # shared by the web and worker dynos
+    CACHES['default'] = {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': REDIS_URL,
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            'IGNORE_EXCEPTIONS': True,  # behave like a cache miss if redis is down
+        },
+    }
+
+# keep sessions (and with them the wizard's answers) in redis instead of the database, see tlfb.sessions
+USE_REDIS_SESSIONS = os.getenv('DJANGO_USE_REDIS_SESSIONS', 'False') == 'True'
+# how long redis keeps a session, long enough past SESSION_EXPIRE_SECONDS to still redirect to the timeout page
+SESSION_CACHE_SECONDS = int(os.getenv('SESSION_CACHE_SECONDS', SESSION_EXPIRE_SECONDS + 24 * 60 * 60))
+if USE_REDIS_SESSIONS:
+    CACHES['sessions'] = {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': REDIS_URL,
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            'CONNECTION_POOL_KWARGS': {'max_connections': int(os.getenv('REDIS_MAX_CONNECTIONS', 20))},
+            'SOCKET_CONNECT_TIMEOUT': 1,  # seconds, fall back to the database quickly if redis is down
+            'SOCKET_TIMEOUT': 1,
+            'IGNORE_EXCEPTIONS': False,  # tlfb.sessions needs the errors to fall back to the database
+        },
+    }
+    SESSION_ENGINE = 'tlfb.sessions'
+    SESSION_CACHE_ALIAS = 'sessions'
+# calendars of logins that were never submitted are deleted once they haven't changed for this long, well after their
+# session has timed out (see purge_drafts)
+DRAFT_MAX_AGE_SECONDS = int(os.getenv('DRAFT_MAX_AGE_SECONDS', SESSION_EXPIRE_SECONDS + 24 * 60 * 60))
+# where the wizard keeps the answers of the day being entered, the session by default
+WIZARD_STORAGE = os.getenv('WIZARD_STORAGE', 'formtools.wizard.storage.session.SessionStorage')
+
+# REDCAP SETTINGS
+REDCAP_IMPORT_CHUNK_SIZE = int(os.getenv('REDCAP_IMPORT_CHUNK_SIZE', 100))  # records per bulk import request
+REDCAP_RETRIES = int(os.getenv('REDCAP_RETRIES', 3))
+REDCAP_TIMEOUT = int(os.getenv('REDCAP_TIMEOUT', 60))  # seconds
+# queue submissions in the outbox and upload them to REDCap, only turn this on once REDCap is configured
+UPLOAD_TO_REDCAP = os.getenv('DJANGO_UPLOAD_TO_REDCAP', 'False') == 'True'
+# a submission that failed this many uploads is left in the outbox for an admin to look at
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 10))
+# a failed submission waits this long before it is retried, doubling with every attempt up to OUTBOX_MAX_BACKOFF_SECONDS,
+# and never less than an upload can take with REDCAP_TIMEOUT and REDCAP_RETRIES
+OUTBOX_BACKOFF_SECONDS = int(os.getenv('OUTBOX_BACKOFF_SECONDS', 60))
+OUTBOX_MAX_BACKOFF_SECONDS = int(os.getenv('OUTBOX_MAX_BACKOFF_SECONDS', 6 * 60 * 60))
+
+# how long a downloaded copy of the REDCap key table is used before it is refreshed
+KEY_TABLE_CACHE_SECONDS = int(os.getenv('KEY_TABLE_CACHE_SECONDS', 300))
+
 # TEMPLATES AND STATIC FILES
 
 TEMPLATES = [
@@ -117,6 +177,14 @@ STATICFILES_DIRS = [
     os.path.join(BASE_DIR, 'static'),
 ]
 
+# admin export files. Web and worker dynos don't share a filesystem on Heroku, so point DJANGO_FILE_STORAGE at a
+# shared storage backend there
+MEDIA_URL = '/media/'
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+DEFAULT_FILE_STORAGE = os.getenv('DJANGO_FILE_STORAGE', 'django.core.files.storage.FileSystemStorage')
+# admin selections larger than this are exported or resubmitted in a background job
+BACKGROUND_EXPORT_THRESHOLD = int(os.getenv('BACKGROUND_EXPORT_THRESHOLD', 500))
+
 # SENTRY AND LOGGING SETTINGS
 RAVEN_CONFIG = {
     'dsn': os.getenv('SENTRY_DSN', ''),
@@ -163,6 +231,16 @@ LOGGING = {
 }
 
 # CELERY SETTINGS
-REDIS_URL = os.environ.get('REDIS_URL', 'redis://')
 BROKER_URL = REDIS_URL
 CELERY_TASK_SERIALIZER = "json"
+CELERYBEAT_SCHEDULE = {
+    'purge-drafts': {
+        'task': 'tlfb.tasks.purge_drafts',
+        'schedule': int(os.getenv('PURGE_DRAFTS_SECONDS', 60 * 60)),
+    },
+}
+if UPLOAD_TO_REDCAP:
+    CELERYBEAT_SCHEDULE['flush-outbox'] = {
+        'task': 'tlfb.tasks.flush_outbox',
+        'schedule': int(os.getenv('OUTBOX_FLUSH_SECONDS', 60)),
+    }
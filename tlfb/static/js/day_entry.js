@@ -0,0 +1,200 @@
+// Single page entry for one calendar day (see views.DayEntryView). Every step of the questionnaire is rendered from
+// the schema, a step is only shown once the option it drills down from is checked, and all the answers are posted at
+// once when the day is submitted.
+$(function () {
+  var $form = $('#day-entry');
+  var $steps = $('#day-entry-steps');
+  var overrides = JSON.parse(document.getElementById('schema-overrides').textContent);
+  var steps = [];
+  var stepsByKey = {};
+
+  $.getJSON($form.data('schema-url'), function (schema) {
+    steps = schema.steps;
+    steps.forEach(function (step) {
+      // the study specific steps and the options of the first step depend on the session
+      if (step.step in overrides.conditions) {
+        var condition = overrides.conditions[step.step];
+        step.hidden = !condition;
+        if (condition) {
+          step.parent = condition[0];
+          step.option = condition[1];
+        }
+      }
+      var choices = overrides.choices[step.step] || {};
+      step.fields.forEach(function (field) {
+        if (choices[field.name]) {
+          field.choices = choices[field.name];
+        }
+      });
+
+      stepsByKey[step.step] = step;
+      step.$el = renderStep(step);
+      $steps.append(step.$el);
+    });
+    updateSteps();
+  });
+
+  $steps.on('change', 'input, select', updateSteps);
+
+  $form.on('submit', function (event) {
+    event.preventDefault();
+    $.ajax({
+      url: window.location.href,
+      method: 'POST',
+      contentType: 'application/json',
+      headers: {'X-CSRFToken': $form.find('[name=csrfmiddlewaretoken]').val()},
+      data: JSON.stringify({date: $form.data('date'), steps: collectAnswers()})
+    }).done(function (response) {
+      window.location = response.redirect;
+    }).fail(function (xhr) {
+      var response = xhr.responseJSON || {};
+      showErrors(response.errors || {}, response.error);
+    });
+  });
+
+  function renderStep(step) {
+    var $step = $('<div class="step">').attr('data-step', step.step);
+    if (step.name) {
+      $step.append($('<h4 class="form-signin-heading">').text(step.name));
+    }
+    $step.append('<div class="errors text-danger"></div>');
+
+    if (step.kind === 'formset') {
+      var $entries = $('<div class="entries">').appendTo($step);
+      var addEntry = function () {
+        $entries.append(renderFields(step, $('<div class="entry">'), $entries.children().length));
+      };
+      addEntry();
+      $('<button type="button" class="col-md-12 btn btn-outline-info mb-4">add another</button>')
+        .on('click', addEntry).appendTo($step);
+    } else {
+      renderFields(step, $step, 0);
+    }
+    return $step;
+  }
+
+  function renderFields(step, $container, index) {
+    step.fields.forEach(function (field) {
+      var id = [step.step, index, field.name].join('-');
+      var $group = $('<div class="form-group">').attr('data-field', field.name).appendTo($container);
+
+      if (field.type === 'multiple') {
+        $group.append($('<label>').text(field.label));
+        field.choices.forEach(function (choice, i) {
+          // drilldown option labels are trusted markup from tlfb.forms
+          $('<div class="form-check">')
+            .append($('<input class="form-check-input" type="checkbox">')
+              .attr({id: id + '-' + i, name: field.name, value: choice[0]}))
+            .append($('<label class="form-check-label">').attr('for', id + '-' + i).html(choice[1]))
+            .appendTo($group);
+        });
+      } else if (field.type === 'boolean') {
+        $('<div class="form-check">')
+          .append($('<input class="form-check-input" type="checkbox">').attr({id: id, name: field.name}))
+          .append($('<label class="form-check-label">').attr('for', id).text(field.label))
+          .appendTo($group);
+      } else {
+        $group.append($('<label>').attr('for', id).text(field.label));
+        var $input;
+        if (field.type === 'choice') {
+          $input = $('<select class="form-control">');
+          field.choices.forEach(function (choice) {
+            $input.append($('<option>').val(choice[0]).text(choice[1]));
+          });
+        } else {
+          $input = $('<input type="text" class="form-control">').attr('placeholder', field.placeholder);
+        }
+        $group.append($input.attr({id: id, name: field.name}));
+      }
+
+      if (field.help_text) {
+        $group.append($('<small class="form-text text-muted">').text(field.help_text));
+      }
+      $group.append('<div class="field-errors text-danger"></div>');
+    });
+    return $container;
+  }
+
+  function isShown(step) {
+    if (step.hidden) {
+      return false;
+    }
+    if (!step.parent) {
+      return true;
+    }
+    var parent = stepsByKey[step.parent];
+    if (!parent || !isShown(parent)) {
+      return false;
+    }
+    return parent.$el.find('input[name=types]:checked').filter(function () {
+      return this.value === step.option;
+    }).length > 0;
+  }
+
+  function updateSteps() {
+    steps.forEach(function (step) {
+      step.$el.toggle(isShown(step));
+    });
+  }
+
+  function collectFields(step, $container) {
+    var values = {};
+    step.fields.forEach(function (field) {
+      var $inputs = $container.find('[data-field="' + field.name + '"] [name]');
+      if (field.type === 'multiple') {
+        values[field.name] = $inputs.filter(':checked').map(function () {
+          return this.value;
+        }).get();
+      } else if (field.type === 'boolean') {
+        values[field.name] = $inputs.is(':checked');
+      } else {
+        values[field.name] = $inputs.val();
+      }
+    });
+    return values;
+  }
+
+  function collectAnswers() {
+    var answers = {};
+    steps.forEach(function (step) {
+      if (!isShown(step)) {
+        return;
+      }
+      if (step.kind === 'formset') {
+        answers[step.step] = step.$el.find('.entry').map(function () {
+          return collectFields(step, $(this));
+        }).get();
+      } else {
+        answers[step.step] = collectFields(step, step.$el);
+      }
+    });
+    return answers;
+  }
+
+  function showFieldErrors($container, errors) {
+    $.each(errors, function (field, messages) {
+      if (field === '__all__') {
+        $container.find('.errors').first().text(messages.join(' '));
+      } else {
+        $container.find('[data-field="' + field + '"] .field-errors').text(messages.join(' '));
+      }
+    });
+  }
+
+  function showErrors(errors, message) {
+    $steps.find('.errors, .field-errors').text('');
+    $.each(errors, function (key, stepErrors) {
+      var step = stepsByKey[key];
+      if (step.kind === 'formset') {
+        step.$el.find('.errors').text((stepErrors.__all__ || []).join(' '));
+        step.$el.find('.entry').each(function (i) {
+          showFieldErrors($(this), stepErrors.forms[i] || {});
+        });
+      } else {
+        showFieldErrors(step.$el, stepErrors);
+      }
+    });
+    $('#day-entry-error').text(message || 'Please correct the errors below.').removeClass('d-none');
+    window.scrollTo(0, 0);
+  }
+});
@@ -2,7 +2,7 @@ import os
 import time
 import celery
 
-from tlfb.transform_helper import export_transformed_data, transform_data
+from tlfb.key_table import invalidate_key_table, get_key_index
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tlfb.settings')
 
@@ -11,14 +11,25 @@ app.config_from_object('django.conf:settings')
 
 
 @app.task
-def submit(subid, timepoint, cohort, pid_number, data):
-    redcap_upload(subid, timepoint, cohort, pid_number, data)
+def export_job(job_id):
+    from tlfb.data.exports import run_export_job  # models can't be imported before the app registry is ready
+    run_export_job(job_id)
 
 
-def redcap_upload(subid, timepoint, cohort, pid_number, data):
-    output = transform_data(subid=subid,
-                            timepoint=timepoint,
-                            cohort=cohort,
-                            pid_number=pid_number,
-                            data=data)
-    export_transformed_data(output)
+@app.task
+def flush_outbox():
+    from tlfb.data.outbox import flush_outbox  # models can't be imported before the app registry is ready
+    flush_outbox()
+
+
+@app.task
+def purge_drafts():
+    from tlfb.data.drafts import purge_days  # models can't be imported before the app registry is ready
+    purge_days()
+
+
+@app.task
+def refresh_key_table():
+    invalidate_key_table()
+    get_key_index()
+
@@ -1,19 +1,33 @@
+import collections
 import csv
+import functools
 import hashlib
+import inspect
 import io
 import logging
 import re
 import os
-from redcap import Project
 from datetime import timedelta
 from raven.contrib.django.raven_compat.models import client
 from tlfb.encrypttest import decrip
+from tlfb.forms import CHOICE_VALUES
+from tlfb.key_table import get_key_record
 
 import requests
 from dateutil.parser import parse
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 LOGGER = logging.getLogger(__name__)
 
+# REDCap session and credentials for this process, see get_storage
+_storage = {}
+
+
+class StorageError(Exception):
+    pass
+
 
 # TODO: before running the code, change the url and API tokens to your orangization's corresponding url and API tokens
 os.environ['API_URL'] = 'https://redcap.ucdenver.edu/api/'
@@ -22,21 +36,77 @@ os.environ['TLFB_TOKEN'] = '[ YOUR TLFB API TOKEN ]'
 
 
 def transform_data(subid, timepoint, cohort, pid_number, data, with_header=True):
-    dk = '9678365400123890'
-    days = [k for k in data.keys()]
-    days.sort()  # they are all like "2018-04-01" so lexical sort works fine
+    transform = build_transform(subid, timepoint, cohort, pid_number, data)
+    return transform_csv(transform, with_header=with_header)
 
-    num_days = len(days)
-    if num_days > 30:
-        # truncate days after 30. This shouldn't be happening with current configuration anyway but lets be safe
-        days = days[0:30]
-        last_date = parse(days[-1])
+
+def transform_csv(transform, with_header=True):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    if with_header:
+        writer.writerow(transform.keys())
+    writer.writerow(transform.values())
+    return output.getvalue()
+
+
+def transform_records(records, with_header=True):
+    """
+    Transform many submissions into one REDCap flat CSV with a single header row. Each record is a dict with the
+    transform_data arguments (subid, timepoint, cohort, data and optionally pid_number). The key table is only looked
+    up once per (subid, timepoint) in the batch.
+    """
+    return ''.join(stream_records(records, with_header=with_header))
+
+
+def stream_records(records, with_header=True):
+    """
+    Same as transform_records, but yields the CSV a line at a time so it never has to be held in memory.
+    """
+    writer = csv.writer(Echo())
+    for transform in iter_transforms(records):
+        if with_header:
+            yield writer.writerow(transform.keys())
+            with_header = False
+        yield writer.writerow(transform.values())
+
+
+class Echo(object):
+    """
+    File-like object that returns whatever is written to it, so one csv writer can produce each line of a stream.
+    """
+
+    def write(self, value):
+        return value
+
+
+def iter_transforms(records):
+    subjects = {}
+    for record in records:
+        subject = (record['subid'], record['timepoint'])
+        if subject not in subjects:
+            subjects[subject] = get_subject_information(*subject)
+        yield build_transform(subid=record['subid'],
+                              timepoint=record['timepoint'],
+                              cohort=record['cohort'],
+                              pid_number=record.get('pid_number', ''),
+                              data=record['data'],
+                              key_data=subjects[subject],
+                              values=record.get('values'))
+
+
+def build_transform(subid, timepoint, cohort, pid_number, data, key_data=None, values=None):
+    """
+    The flat REDCap record of a submission. values are its per-day columns and summaries as stored by
+    get_transform_values, they are only computed from data if they aren't given.
+    """
+    dk = '9678365400123890'
+    if values is None:
+        values = build_values(data)
     else:
-        last_date = parse(days[-1])
-    for i in range(len(days), 30):
-        days.append((last_date + timedelta(days=i + 1)).date().isoformat())
+        values = collections.OrderedDict(zip(VALUE_COLUMNS, values))
 
-    key_data = get_subject_information(subid, timepoint)
+    if key_data is None:
+        key_data = get_subject_information(subid, timepoint)
 
     # cohort number decrypted from the url
     cohort_number = decrip(dk, cohort)
@@ -77,223 +147,50 @@ def transform_data(subid, timepoint, cohort, pid_number, data, with_header=True)
         'cohort_illegal': cohort_number,
     }
 
+    transform.update(values)
+    return transform
+
+
+def build_values(data):
+    # everything in the record that only depends on the answers: the per-day columns and their summaries
+    days = [k for k in data.keys()]
+    days.sort()  # they are all like "2018-04-01" so lexical sort works fine
+
+    num_days = len(days)
+    if num_days > 30:
+        # truncate days after 30. This shouldn't be happening with current configuration anyway but lets be safe
+        days = days[0:30]
+        last_date = parse(days[-1])
+    else:
+        last_date = parse(days[-1])
+    for i in range(len(days), 30):
+        days.append((last_date + timedelta(days=i + 1)).date().isoformat())
+
+    values = collections.OrderedDict()
     for idx, day in enumerate(days):
-        suffix = '_d' + str(idx + 1).zfill(2)
         substances = data.get(day, {}).get('substances', {})
-        transform['subst_bin' + suffix] = ','.join([
-            '1' if [x for x in substances.keys() if
-                    x in ['beer', 'wine', 'shots', 'other_alcohol_name', 'other_alcohol_quantity']] else '0',
-            '1' if [x for x in substances.keys() if
-                    x in ['cigarettes', 'ecigs', 'chew', 'cigars', 'hookah', 'other_tobacco_name',
-                          'other_tobacco_quantity']] else '0',
-            '1' if [x for x in substances.keys() if
-                    x in ['study_cannabis_flower_total_grams', 'study_cannabis_edible_thc',
-                          'study_cannabis_edible_cbd']] else '0',
-            '1' if [x for x in substances.keys() if
-                    x in ['non_study_cannabis_flower_total_grams', 'non_study_cannabis_flower_or_bud_thc',
-                          'non_study_cannabis_flower_or_bud_cbd', 'non_study_cannabis_edible_thc',
-                          'non_study_cannabis_edible_cbd', 'non_study_cannabis_concentrate',
-                          'non_study_cannabis_concentrate_thc', 'non_study_cannabis_concentrate_cbd',
-                          'non_study_cannabis_topical_patch', 'non_study_other_cannabis_name',
-                          'cannabis_concentrate','cannabis_concentrate_thc','cannabis_concentrate_cbd',
-                          'cannabis_flower_or_bud', 'cannabis_flower_or_bud_cbd','cannabis_flower_or_bud_thc',
-                          'cannabis_edible_thc','cannabis_edible_cbd']] else '0',
-            '1' if [x for x in substances.keys() if
-                    x in ['opioids', 'opioid_dosage',
-                          'sleep_medication', 'sleep_medication_dosage',
-                          'muscle_relaxants', 'muscle_relaxants_dosage',
-                          'nsaids', 'nsaids_dosage',
-                          'nerve_pain_medicine', 'nerve_pain_medicine_dosage',
-                          'adhd_medicine', 'adhd_medicine_dosage',
-                          'other_medicine_name', 'other_medicine', 'other_medicine_dosage']] else '0',
-            '1' if [x for x in substances.keys() if
-                    x in ['cocaine', 'amphetamine', 'methamphetamine', 'mdma', 'heroin',
-                          'lsd', 'mushrooms', 'peyote', 'ecstasy', 'other_illegal_drugs']] else '0',
-            '1' if [x for x in substances.keys() if x in ['other_substances']] else '0',
-        ])
-
-        transform['alc_beer_drinks' + suffix] = get_answer(substances, 'beer')
-        transform['alc_wine_drinks' + suffix] = get_answer(substances, 'wine')
-        transform['alc_hliq_drinks' + suffix] = get_answer(substances, 'shots')
-        transform['alc_other_names' + suffix] = get_answer(substances, 'other_alcohol_quantity')
-        transform['alc_other_drinks' + suffix] = get_answer(substances, 'other_alcohol_quantity')
-
-        transform['tob_cigtts_amt' + suffix] = get_answer(substances, 'cigarettes')
-        transform['tob_ecigs_amt' + suffix] = get_answer(substances, 'ecigs')
-        transform['tob_chew_amt' + suffix] = get_answer(substances, 'chew')
-        transform['tob_cigars_amt' + suffix] = get_answer(substances, 'cigars')
-        transform['tob_hookah_amt' + suffix] = get_answer(substances, 'hookah')
-        transform['tob_other_names' + suffix] = get_answer(substances, 'other_tobacco_name')
-
-        transform['tob_other_amt' + suffix] = get_answer(substances, 'other_tobacco_quantity')
-        transform['scan_flw_g' + suffix] = get_answer(substances, 'study_cannabis_flower_total_grams')
-        transform['scan_edithc_mg' + suffix] = get_answer(substances, 'study_cannabis_edible_thc')
-        transform['scan_edicbd_mg' + suffix] = get_answer(substances, 'study_cannabis_edible_cbd')
-        transform['ncan_flw_g' + suffix] = get_answer(substances, 'non_study_cannabis_flower_total_grams')
-        transform['ncan_flwthc_perc' + suffix] = get_answer(substances, 'non_study_cannabis_flower_or_bud_thc')
-        transform['ncan_flwcbd_perc' + suffix] = get_answer(substances, 'non_study_cannabis_flower_or_bud_cbd')
-        transform['ncan_edithc_mg' + suffix] = get_answer(substances, 'non_study_cannabis_edible_thc')
-        transform['ncan_edicbd_mg' + suffix] = get_answer(substances, 'non_study_cannabis_edible_cbd')
-        transform['ncan_dab_hits' + suffix] = get_answer(substances, 'non_study_cannabis_concentrate')
-        transform['ncan_dabthc_perc' + suffix] = get_answer(substances, 'non_study_cannabis_concentrate_thc')
-        transform['ncan_dabcbd_perc' + suffix] = get_answer(substances, 'non_study_cannabis_concentrate_cbd')
-        transform['ncan_patch_noyes' + suffix] = get_answer(substances, 'non_study_cannabis_topical_patch')
-        transform['ncan_other_names' + suffix] = get_answer(substances, 'non_study_other_cannabis_name')
-
-        other_rx = get_answer(substances, 'other_medicine_name')
-
-        transform['rx_all_names' + suffix] = (','.join(
-            [x for x in substances.keys() if
-             x in ['opioids', 'sleep_medication', 'muscle_relaxants', 'nsaids', 'nerve_pain_medicine', 'adhd_medicine'
-                   ]])) + (',' + other_rx) if other_rx else ''
-
-        transform['rx_opd_pills' + suffix] = get_answer(substances, 'opioids')
-        transform['rx_opd_mgpp' + suffix] = get_answer(substances, 'opioid_dosage')
-        transform['rx_sleep_pills' + suffix] = get_answer(substances, 'sleep_medication')
-        transform['rx_sleep_mgpp' + suffix] = get_answer(substances, 'sleep_medication_dosage')
-        transform['rx_mrelax_pills' + suffix] = get_answer(substances, 'muscle_relaxants')
-        transform['rx_mrelax_mgpp' + suffix] = get_answer(substances, 'muscle_relaxants_dosage')
-        transform['rx_nsaid_pills' + suffix] = get_answer(substances, 'nsaids')
-        transform['rx_nsaid_mgpp' + suffix] = get_answer(substances, 'nsaids_dosage')
-        transform['rx_nerv_pills' + suffix] = get_answer(substances, 'nerve_pain_medicine')
-        transform['rx_nerv_mgpp' + suffix] = get_answer(substances, 'nerve_pain_medicine_dosage')
-        transform['rx_adhd_pills' + suffix] = get_answer(substances, 'adhd_medicine')
-        transform['rx_adhd_mgpp' + suffix] = get_answer(substances, 'adhd_medicine_dosage')
-        transform['rx_other_names' + suffix] = get_answer(substances, 'other_medicine_name')
-        transform['rx_other_pills' + suffix] = get_answer(substances, 'other_medicine')
-        transform['rx_other_mgpp' + suffix] = get_answer(substances, 'other_medicine_dosage')
-        other_illegal = get_answer(substances, 'other_illegal_drugs')
-        illegal_drugs = [x for x in substances.keys() if
-                         x in ['cocaine', 'amphetamine', 'methamphetamine', 'mdma', 'heroin', 'lsd', 'mushrooms',
-                               'peyote', 'ecstasy']]
-
-        if other_illegal:
-            illegal_drugs.append(other_illegal)
-        transform['illegal_all_names' + suffix] = ','.join(illegal_drugs)
-        transform['illegal_other_names' + suffix] = get_all_others(substances)
-
-    aggregate_data = {
-        # STUDY CANNABIS
-        # FLOWER
-        'summ_total_scan_flw_g': get_agg(transform, ['scan_flw_g']),
-        'summ_total_scan_flw_d': get_multikey_days(transform, ['scan_flw_g']),
-        'summ_avg_scan_flw_gpd' : get_average(transform, ['scan_flw_g']),
-
-        # EDIBLE
-        'summ_total_scan_edithc_mg': get_agg(transform, ['scan_edithc_mg']),
-        'summ_total_scan_edicbd_mg': get_agg(transform, ['scan_edicbd_mg']),
-        'summ_total_scan_edi_mg':  get_agg(transform, ['scan_edithc_mg','scan_edicbd_mg']),
-
-        'summ_total_scan_edi_d': get_multikey_days(transform, ['scan_edithc_mg','scan_edicbd_mg']),
-        'summ_avg_scan_edi_mgpd': get_average(transform, ['scan_edithc_mg','scan_edicbd_mg']),
-
-
-        # NON-STUDY cannabis
-        # FLOWER
-        'summ_total_ncan_flw_g': get_agg(transform, ['ncan_flw_g']),
-        'summ_total_ncan_flw_d': get_multikey_days(transform, ['ncan_flw_g']),
-        'summ_avg_ncan_flw_gpd': get_average(transform, ['ncan_flw_g']),
-        'summ_avg_ncan_flwthc_perc': get_average(transform, ['ncan_flwthc_perc']),
-        'summ_avg_ncan_flwcbd_perc': get_average(transform, ['ncan_flwcbd_perc']),
-
-        # EDIBLE
-        'summ_total_ncan_edithc_mg': get_agg(transform, ['ncan_edithc_mg']),
-        'summ_total_ncan_edicbd_mg': get_agg(transform, ['ncan_edicbd_mg']),
-        'summ_total_ncan_edi_mg': get_agg(transform, ['ncan_edithc_mg','ncan_edicbd_mg']),
-
-        'summ_total_ncan_edi_d': get_multikey_days(transform, ['ncan_edithc_mg','ncan_edicbd_mg']),
-        'summ_avg_ncan_edi_mgpd': get_average(transform, ['ncan_edithc_mg','ncan_edicbd_mg']),
-
-        # CONCENTRATE
-        'summ_total_ncan_dab_hits': get_agg(transform, ['ncan_dab_hits']),
-        'summ_total_ncan_dab_d': get_multikey_days(transform, ['ncan_dab_hits']),
-        'summ_avg_ncan_dab_hitspd': get_average(transform, ['ncan_dab_hits']),
-
-        'summ_avg_ncan_dabthc_perc': get_average(transform, ['ncan_dabthc_perc']),
-        'summ_avg_ncan_dabcbd_perc': get_average(transform, ['ncan_dabcbd_perc']),
-        'summ_total_ncan_patch_d': get_multikey_days(transform, ['ncan_patch_noyes']),
-
-
-        # STUDY AND NON COMBINED
-        # EDIBLE
-        'summ_total_can_edi_mg': get_agg(transform, ['ncan_edithc_mg','scan_edithc_mg','ncan_edicbd_mg','scan_edicbd_mg']),
-        'summ_total_can_edi_d': get_multikey_days(transform, ['ncan_edithc_mg','scan_edithc_mg','ncan_edicbd_mg','scan_edicbd_mg']),
-        'summ_avg_can_edi_mgpd': get_average(transform, ['ncan_edithc_mg','scan_edithc_mg','ncan_edicbd_mg','scan_edicbd_mg']),
-
-        # FLOWER
-        'summ_total_can_flw_g': get_agg(transform, ['ncan_flw_g','scan_flw_g']),
-        'summ_total_can_flw_d': get_multikey_days(transform, ['ncan_flw_g','scan_flw_g']),
-        'summ_avg_can_flw_gpd': get_average(transform, ['ncan_flw_g','scan_flw_g']),
-
-
-        # CANNABIS DAILY TOTALS
-        'summ_total_scan_all_d': get_multikey_days(transform, ['scan']),
-        'summ_total_ncan_all_d': get_multikey_days(transform, ['ncan']),
-        'summ_total_can_all_d': get_multikey_days(transform, ['can']),
-
-
-        # ALCOHOL
-        'summ_total_canalc_d': get_multikey_same_days(transform, ['can', 'alc']),
-
-        # ALL ALCOHOL
-        'summ_total_alc_all_drinks': get_agg(transform, ['alc']),
-        'summ_total_alc_all_d': get_multikey_days(transform, ['alc']),
-        'summ_avg_alc_all_drinkspd': get_average(transform, ['alc']),
-
-
-        # TOBACCO
-        'summ_total_tob_cigtts_amt': get_agg(transform, ['tob_cigtts']),
-        'summ_total_tob_ecigs_amt': get_agg(transform, ['tob_ecigs']),
-        'summ_total_tob_chew_amt': get_agg(transform, ['tob_chew']),
-        'summ_total_tob_cigars_amt': get_agg(transform, ['tob_cigars']),
-        'summ_total_tob_hookah_amt': get_agg(transform, ['tob_hookah']),
-
-        'summ_total_tob_cigtts_d': get_multikey_days(transform, ['tob_cigtts']),
-        'summ_total_tob_ecigs_d':get_multikey_days(transform, ['tob_ecigs']),
-        'summ_total_tob_chew_d':get_multikey_days(transform, ['tob_chew']),
-        'summ_total_tob_cigars_d': get_multikey_days(transform, ['tob_cigars']),
-        'summ_total_tob_hookah_d':get_multikey_days(transform, ['tob_hookah']),
-        'summ_total_tob_all_d':get_multikey_days(transform, ['tob']),
-
-
-        # RECREATIONAL
-        'summ_total_rx_opd_mg': get_mg(transform, ['rx_opd']),
-        'summ_total_rx_sleep_mg': get_mg(transform, ['rx_sleep']),
-        'summ_total_rx_mrelax_mg': get_mg(transform, ['rx_mrelax']),
-        'summ_total_rx_nsaid_mg': get_mg(transform, ['rx_nsaid']),
-        'summ_total_rx_nerv_mg': get_mg(transform, ['rx_nerv']),
-        'summ_total_rx_adhd_mg': get_mg(transform, ['rx_adhd']),
-        'summ_total_rx_other_mg': get_mg(transform, ['rx_other']),
-
-        'summ_total_rx_opd_d': get_multikey_days(transform, ['rx_opd']),
-        'summ_total_rx_sleep_d': get_multikey_days(transform, ['rx_sleep']),
-        'summ_total_rx_mrelax_d': get_multikey_days(transform, ['rx_mrelax']),
-        'summ_total_rx_nsaid_d': get_multikey_days(transform, ['rx_nsaid']),
-        'summ_total_rx_nerv_d': get_multikey_days(transform, ['rx_nerv']),
-        'summ_total_rx_adhd_d': get_multikey_days(transform, ['rx_adhd']),
-        'summ_total_rx_other_d': get_multikey_days(transform, ['rx_other']),
-        'summ_total_rx_all_d': get_multikey_days(transform, ['rx']),
-
-        # ILLEGAL
-        'summ_total_illegal_all_d': get_multikey_days(transform, ['illegal']),
-    }
+        for columns, read in DAY_FIELDS:
+            values[columns[idx]] = read(substances)
 
-    transform.update(aggregate_data)
+    aggregate_data = summarize(values)
+
+    values.update(aggregate_data)
+    return values
 
-    output = io.StringIO()
-    writer = csv.writer(output)
-    if with_header:
-        writer.writerow(transform.keys())
-    writer.writerow(transform.values())
-    return output.getvalue()
+
+def get_transform_values(data):
+    """
+    The per-day columns and summaries of a submission as a list in VALUE_COLUMNS order, to be stored with it and passed
+    back to build_transform as long as it was stored under the current TRANSFORM_VERSION.
+    """
+    return list(build_values(data).values())
 
 
 def get_subject_information(subid, timepoint):
     key_data = {}
     try:
-        key_table_project = Project(os.getenv('API_URL'), os.getenv('COHORT_KEY_TABLE_TOKEN'))
-        records = key_table_project.export_records()
-        # TODO: Add in code to assign your study id and cohort from your REDCAP Survey
+        record = get_key_record(subid, timepoint) or {}
+        # TODO: Add in code to assign your study id and cohort from your REDCAP Survey record
     except:
         client.captureException()
         key_data['cohort'] = '-1'
@@ -302,10 +199,59 @@ def get_subject_information(subid, timepoint):
 
 
 def export_transformed_data(output):
+    count = post_records(output, record_id=get_output_sha(output)[:16])
+    if count == 1:
+        LOGGER.info('Successfully uploaded to storage')
+        return True
+    return False
+
+
+def get_output_sha(output):
     sha = hashlib.sha1()
     sha.update(output.encode('utf-8'))
-    r = requests.post(os.getenv('API_URL'), data={
-        'token': os.getenv('TLFB_TOKEN'),
+    return sha.hexdigest()
+
+
+def export_transformed_records(transforms, chunk_size=None):
+    """
+    Uploads many flat records (see build_transform) as multi-row CSV imports of up to chunk_size records each. Returns
+    a list with True for every record REDCap accepted, in the same order as transforms.
+    """
+    transforms = list(transforms)
+    chunk_size = chunk_size or settings.REDCAP_IMPORT_CHUNK_SIZE
+    uploaded = []
+    for start in range(0, len(transforms), chunk_size):
+        uploaded.extend(import_chunk(transforms[start:start + chunk_size]))
+    return uploaded
+
+
+def import_chunk(transforms):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(transforms[0].keys())
+    for transform in transforms:
+        writer.writerow(transform.values())
+
+    count = post_records(output.getvalue())
+    if count >= len(transforms):
+        LOGGER.info('Successfully uploaded {} records to storage'.format(count))
+        return [True] * len(transforms)
+    if len(transforms) == 1:
+        return [False]
+    # REDCap only returns how many records it imported, so split a chunk it imported fewer of until the rejected
+    # records are found
+    middle = len(transforms) // 2
+    return import_chunk(transforms[:middle]) + import_chunk(transforms[middle:])
+
+
+def post_records(output, **extra):
+    """
+    Imports flat CSV records and returns how many REDCap accepted, 0 if it rejected them. Raises StorageError if the
+    request itself failed (a bad token, an error page) and connection errors once the session has used up its retries.
+    """
+    storage = get_storage()
+    data = {
+        'token': storage['token'],
         'content': 'record',
         'format': 'csv',
         'type': 'flat',
@@ -314,22 +260,51 @@ def export_transformed_data(output):
         'data': output,
         'returnContent': 'count',
         'returnFormat': 'json',
-        'record_id': sha.hexdigest()[:16]
-    })
-    result = r.json()
-
-    if result.get('count'):
-        count = result.get('count')
-        if count == 1:
-            LOGGER.info('Successfully uploaded to storage')
-        else:
-            LOGGER.error('Storage returned an error: '+result)
-    else:
-        LOGGER.error('Storage returned an error: '+result)
-    return False
+    }
+    data.update(extra)
+    r = storage['session'].post(storage['url'], data=data, timeout=settings.REDCAP_TIMEOUT)
+    try:
+        result = r.json()
+    except ValueError:
+        raise StorageError('Storage returned {}: {}'.format(r.status_code, r.text[:500]))
+
+    if r.status_code == 200 and isinstance(result, dict) and result.get('count') is not None:
+        return int(result['count'])
+    # REDCap rejects the whole import with a 400 and a JSON error when any of its records is invalid
+    if r.status_code == 400 and isinstance(result, dict) and result.get('error'):
+        LOGGER.error('Storage rejected the records: {}'.format(result['error']))
+        return 0
+    raise StorageError('Storage returned {}: {}'.format(r.status_code, result))
+
+
+def get_storage():
+    """
+    One pooled keep-alive session per process, so uploads don't open a new connection for every record.
+    """
+    if not _storage:
+        retries = Retry(total=settings.REDCAP_RETRIES, backoff_factor=1, status_forcelist=[500, 502, 503, 504],
+                        method_whitelist=False)
+        session = requests.Session()
+        session.mount('https://', HTTPAdapter(max_retries=retries))
+        session.mount('http://', HTTPAdapter(max_retries=retries))
+        _storage.update(session=session, url=os.getenv('API_URL'), token=os.getenv('TLFB_TOKEN'))
+    return _storage
+
+
+LEGACY_UNITS = re.compile(r"[\(\[].*?[\)\]]")  # some legacy responses are like "0.5 (1/2 gram)"
+NON_NUMERIC = re.compile(r'[a-zA-Z /,]+')  # remove characters and spaces and slashes and commas
 
 
 def value_converter(raw_string):
+    # almost every answer is one of the form choices, so those are converted once at import
+    try:
+        return CONVERTED_CHOICES[raw_string]
+    except KeyError:
+        return convert_value(raw_string)
+
+
+@functools.lru_cache(maxsize=4096)
+def convert_value(raw_string):
     if raw_string.lower() == 'yes':
         return '1'
     value = raw_string.replace('1/2', '.5')
@@ -338,8 +313,8 @@ def value_converter(raw_string):
     value = value.replace('or more', '')
     value = value.replace('or less', '')
     value = value.replace(' ', '')
-    value = re.sub("[\(\[].*?[\)\]]", "", value)  # some legacy responses are like "0.5 (1/2 gram)"
-    value = re.sub(r'[a-zA-Z /,]+', '', value)  # remove characters and spaces and slashes and commas
+    value = LEGACY_UNITS.sub("", value)
+    value = NON_NUMERIC.sub('', value)
     if value in  ['999','Unknown']:
          value = '-9999';
     if value in ['----']:
@@ -347,6 +322,9 @@ def value_converter(raw_string):
     return value
 
 
+CONVERTED_CHOICES = {value: convert_value.__wrapped__(value) for value in CHOICE_VALUES}
+
+
 def unknown_check(sum, value, first_agg_check = False):
     if first_agg_check:
         return  float(value)
@@ -370,16 +348,24 @@ def unknown_check(sum, value, first_agg_check = False):
 
 
 def get_answer(substances, substance_name):
-    # return a string even if its not there
-    val = substances.get(substance_name) or {}
+    return read_answer(substances, substance_name, get_legacy_answer_key(substance_name))
 
-    # this line is only to correct for variables that were created earlier and
+
+def get_legacy_answer_key(substance_name):
+    # this is only to correct for variables that were created earlier and
     # don't have 'non_study' or 'study' as part of their name
-    if not val and substance_name[:9] == 'non_study':
+    if substance_name[:9] == 'non_study':
         if substance_name == 'non_study_cannabis_flower_total_grams':
-            val = substances.get('cannabis_flower_or_bud') or {}
-        else:
-            val = substances.get(substance_name[10:]) or {}
+            return 'cannabis_flower_or_bud'
+        return substance_name[10:]
+    return None
+
+
+def read_answer(substances, substance_name, legacy_name=None):
+    # return a string even if its not there
+    val = substances.get(substance_name) or {}
+    if not val and legacy_name:
+        val = substances.get(legacy_name) or {}
 
     # gets the value of the answer
     if isinstance(val, str):
@@ -387,7 +373,7 @@ def get_answer(substances, substance_name):
     if val:
         value = value_converter(val.get('answer', ''))
         return value
-    return val.get('answer', '')
+    return ''
 
 
 def get_agg(data, keys):
@@ -516,3 +502,426 @@ def get_all_others(substances):
             other_drugs.append(other_drug)
             i += 1
     return ','.join(other_drugs)
+
+
+def get_substance_flags(substances):
+    return ','.join('0' if group.isdisjoint(substances) else '1' for group in SUBSTANCE_GROUPS)
+
+
+def get_rx_names(substances):
+    other_rx = get_answer(substances, 'other_medicine_name')
+    if not other_rx:
+        return ''
+    return ','.join([x for x in substances if x in RX_NAMES]) + ',' + other_rx
+
+
+def get_illegal_names(substances):
+    illegal_drugs = [x for x in substances if x in ILLEGAL_NAMES]
+    other_illegal = get_answer(substances, 'other_illegal_drugs')
+    if other_illegal:
+        illegal_drugs.append(other_illegal)
+    return ','.join(illegal_drugs)
+
+
+MAX_DAYS = 30
+
+# answer keys that flag each substance group in subst_bin: alcohol, tobacco, study cannabis, non-study cannabis,
+# prescriptions, illegal drugs and other substances
+SUBSTANCE_GROUPS = (
+    frozenset(['beer', 'wine', 'shots', 'other_alcohol_name', 'other_alcohol_quantity']),
+    frozenset(['cigarettes', 'ecigs', 'chew', 'cigars', 'hookah', 'other_tobacco_name', 'other_tobacco_quantity']),
+    frozenset(['study_cannabis_flower_total_grams', 'study_cannabis_edible_thc', 'study_cannabis_edible_cbd']),
+    frozenset(['non_study_cannabis_flower_total_grams', 'non_study_cannabis_flower_or_bud_thc',
+               'non_study_cannabis_flower_or_bud_cbd', 'non_study_cannabis_edible_thc',
+               'non_study_cannabis_edible_cbd', 'non_study_cannabis_concentrate',
+               'non_study_cannabis_concentrate_thc', 'non_study_cannabis_concentrate_cbd',
+               'non_study_cannabis_topical_patch', 'non_study_other_cannabis_name',
+               'cannabis_concentrate', 'cannabis_concentrate_thc', 'cannabis_concentrate_cbd',
+               'cannabis_flower_or_bud', 'cannabis_flower_or_bud_cbd', 'cannabis_flower_or_bud_thc',
+               'cannabis_edible_thc', 'cannabis_edible_cbd']),
+    frozenset(['opioids', 'opioid_dosage',
+               'sleep_medication', 'sleep_medication_dosage',
+               'muscle_relaxants', 'muscle_relaxants_dosage',
+               'nsaids', 'nsaids_dosage',
+               'nerve_pain_medicine', 'nerve_pain_medicine_dosage',
+               'adhd_medicine', 'adhd_medicine_dosage',
+               'other_medicine_name', 'other_medicine', 'other_medicine_dosage']),
+    frozenset(['cocaine', 'amphetamine', 'methamphetamine', 'mdma', 'heroin',
+               'lsd', 'mushrooms', 'peyote', 'ecstasy', 'other_illegal_drugs']),
+    frozenset(['other_substances']),
+)
+RX_NAMES = frozenset(['opioids', 'sleep_medication', 'muscle_relaxants', 'nsaids', 'nerve_pain_medicine',
+                      'adhd_medicine'])
+ILLEGAL_NAMES = frozenset(['cocaine', 'amphetamine', 'methamphetamine', 'mdma', 'heroin', 'lsd', 'mushrooms',
+                           'peyote', 'ecstasy'])
+
+# (column, answer key or function of the day's substances) for every per-day column, in the order they are written to
+# the CSV. To add a substance, add its column here and to SUMMARY_FIELDS if it needs a summary
+DAY_COLUMNS = (
+    ('subst_bin', get_substance_flags),
+
+    ('alc_beer_drinks', 'beer'),
+    ('alc_wine_drinks', 'wine'),
+    ('alc_hliq_drinks', 'shots'),
+    ('alc_other_names', 'other_alcohol_quantity'),
+    ('alc_other_drinks', 'other_alcohol_quantity'),
+
+    ('tob_cigtts_amt', 'cigarettes'),
+    ('tob_ecigs_amt', 'ecigs'),
+    ('tob_chew_amt', 'chew'),
+    ('tob_cigars_amt', 'cigars'),
+    ('tob_hookah_amt', 'hookah'),
+    ('tob_other_names', 'other_tobacco_name'),
+
+    ('tob_other_amt', 'other_tobacco_quantity'),
+    ('scan_flw_g', 'study_cannabis_flower_total_grams'),
+    ('scan_edithc_mg', 'study_cannabis_edible_thc'),
+    ('scan_edicbd_mg', 'study_cannabis_edible_cbd'),
+    ('ncan_flw_g', 'non_study_cannabis_flower_total_grams'),
+    ('ncan_flwthc_perc', 'non_study_cannabis_flower_or_bud_thc'),
+    ('ncan_flwcbd_perc', 'non_study_cannabis_flower_or_bud_cbd'),
+    ('ncan_edithc_mg', 'non_study_cannabis_edible_thc'),
+    ('ncan_edicbd_mg', 'non_study_cannabis_edible_cbd'),
+    ('ncan_dab_hits', 'non_study_cannabis_concentrate'),
+    ('ncan_dabthc_perc', 'non_study_cannabis_concentrate_thc'),
+    ('ncan_dabcbd_perc', 'non_study_cannabis_concentrate_cbd'),
+    ('ncan_patch_noyes', 'non_study_cannabis_topical_patch'),
+    ('ncan_other_names', 'non_study_other_cannabis_name'),
+
+    ('rx_all_names', get_rx_names),
+
+    ('rx_opd_pills', 'opioids'),
+    ('rx_opd_mgpp', 'opioid_dosage'),
+    ('rx_sleep_pills', 'sleep_medication'),
+    ('rx_sleep_mgpp', 'sleep_medication_dosage'),
+    ('rx_mrelax_pills', 'muscle_relaxants'),
+    ('rx_mrelax_mgpp', 'muscle_relaxants_dosage'),
+    ('rx_nsaid_pills', 'nsaids'),
+    ('rx_nsaid_mgpp', 'nsaids_dosage'),
+    ('rx_nerv_pills', 'nerve_pain_medicine'),
+    ('rx_nerv_mgpp', 'nerve_pain_medicine_dosage'),
+    ('rx_adhd_pills', 'adhd_medicine'),
+    ('rx_adhd_mgpp', 'adhd_medicine_dosage'),
+    ('rx_other_names', 'other_medicine_name'),
+    ('rx_other_pills', 'other_medicine'),
+    ('rx_other_mgpp', 'other_medicine_dosage'),
+
+    ('illegal_all_names', get_illegal_names),
+    ('illegal_other_names', get_all_others),
+)
+
+
+def compile_day_fields(day_columns):
+    # resolve every column's per-day names and its reader, including the legacy key fallback, once at import
+    fields = []
+    for column, source in day_columns:
+        names = tuple(column + '_d' + str(idx + 1).zfill(2) for idx in range(MAX_DAYS))
+        if callable(source):
+            fields.append((names, source))
+        else:
+            fields.append((names, functools.partial(read_answer, substance_name=source,
+                                                    legacy_name=get_legacy_answer_key(source))))
+    return tuple(fields)
+
+
+DAY_FIELDS = compile_day_fields(DAY_COLUMNS)
+
+
+# (field, aggregate, keys) for every summary column, in the order they are written to the CSV. The aggregates mirror
+# the helpers above: 'total' -> get_agg, 'days' -> get_multikey_days, 'average' -> get_average, 'mg' -> get_mg and
+# 'same_days' -> get_multikey_same_days
+SUMMARY_FIELDS = (
+    # STUDY CANNABIS
+    # FLOWER
+    ('summ_total_scan_flw_g', 'total', ('scan_flw_g',)),
+    ('summ_total_scan_flw_d', 'days', ('scan_flw_g',)),
+    ('summ_avg_scan_flw_gpd', 'average', ('scan_flw_g',)),
+
+    # EDIBLE
+    ('summ_total_scan_edithc_mg', 'total', ('scan_edithc_mg',)),
+    ('summ_total_scan_edicbd_mg', 'total', ('scan_edicbd_mg',)),
+    ('summ_total_scan_edi_mg', 'total', ('scan_edithc_mg', 'scan_edicbd_mg')),
+
+    ('summ_total_scan_edi_d', 'days', ('scan_edithc_mg', 'scan_edicbd_mg')),
+    ('summ_avg_scan_edi_mgpd', 'average', ('scan_edithc_mg', 'scan_edicbd_mg')),
+
+    # NON-STUDY cannabis
+    # FLOWER
+    ('summ_total_ncan_flw_g', 'total', ('ncan_flw_g',)),
+    ('summ_total_ncan_flw_d', 'days', ('ncan_flw_g',)),
+    ('summ_avg_ncan_flw_gpd', 'average', ('ncan_flw_g',)),
+    ('summ_avg_ncan_flwthc_perc', 'average', ('ncan_flwthc_perc',)),
+    ('summ_avg_ncan_flwcbd_perc', 'average', ('ncan_flwcbd_perc',)),
+
+    # EDIBLE
+    ('summ_total_ncan_edithc_mg', 'total', ('ncan_edithc_mg',)),
+    ('summ_total_ncan_edicbd_mg', 'total', ('ncan_edicbd_mg',)),
+    ('summ_total_ncan_edi_mg', 'total', ('ncan_edithc_mg', 'ncan_edicbd_mg')),
+
+    ('summ_total_ncan_edi_d', 'days', ('ncan_edithc_mg', 'ncan_edicbd_mg')),
+    ('summ_avg_ncan_edi_mgpd', 'average', ('ncan_edithc_mg', 'ncan_edicbd_mg')),
+
+    # CONCENTRATE
+    ('summ_total_ncan_dab_hits', 'total', ('ncan_dab_hits',)),
+    ('summ_total_ncan_dab_d', 'days', ('ncan_dab_hits',)),
+    ('summ_avg_ncan_dab_hitspd', 'average', ('ncan_dab_hits',)),
+
+    ('summ_avg_ncan_dabthc_perc', 'average', ('ncan_dabthc_perc',)),
+    ('summ_avg_ncan_dabcbd_perc', 'average', ('ncan_dabcbd_perc',)),
+    ('summ_total_ncan_patch_d', 'days', ('ncan_patch_noyes',)),
+
+    # STUDY AND NON COMBINED
+    # EDIBLE
+    ('summ_total_can_edi_mg', 'total', ('ncan_edithc_mg', 'scan_edithc_mg', 'ncan_edicbd_mg', 'scan_edicbd_mg')),
+    ('summ_total_can_edi_d', 'days', ('ncan_edithc_mg', 'scan_edithc_mg', 'ncan_edicbd_mg', 'scan_edicbd_mg')),
+    ('summ_avg_can_edi_mgpd', 'average', ('ncan_edithc_mg', 'scan_edithc_mg', 'ncan_edicbd_mg', 'scan_edicbd_mg')),
+
+    # FLOWER
+    ('summ_total_can_flw_g', 'total', ('ncan_flw_g', 'scan_flw_g')),
+    ('summ_total_can_flw_d', 'days', ('ncan_flw_g', 'scan_flw_g')),
+    ('summ_avg_can_flw_gpd', 'average', ('ncan_flw_g', 'scan_flw_g')),
+
+    # CANNABIS DAILY TOTALS
+    ('summ_total_scan_all_d', 'days', ('scan',)),
+    ('summ_total_ncan_all_d', 'days', ('ncan',)),
+    ('summ_total_can_all_d', 'days', ('can',)),
+
+    # ALCOHOL
+    ('summ_total_canalc_d', 'same_days', ('can', 'alc')),
+
+    # ALL ALCOHOL
+    ('summ_total_alc_all_drinks', 'total', ('alc',)),
+    ('summ_total_alc_all_d', 'days', ('alc',)),
+    ('summ_avg_alc_all_drinkspd', 'average', ('alc',)),
+
+    # TOBACCO
+    ('summ_total_tob_cigtts_amt', 'total', ('tob_cigtts',)),
+    ('summ_total_tob_ecigs_amt', 'total', ('tob_ecigs',)),
+    ('summ_total_tob_chew_amt', 'total', ('tob_chew',)),
+    ('summ_total_tob_cigars_amt', 'total', ('tob_cigars',)),
+    ('summ_total_tob_hookah_amt', 'total', ('tob_hookah',)),
+
+    ('summ_total_tob_cigtts_d', 'days', ('tob_cigtts',)),
+    ('summ_total_tob_ecigs_d', 'days', ('tob_ecigs',)),
+    ('summ_total_tob_chew_d', 'days', ('tob_chew',)),
+    ('summ_total_tob_cigars_d', 'days', ('tob_cigars',)),
+    ('summ_total_tob_hookah_d', 'days', ('tob_hookah',)),
+    ('summ_total_tob_all_d', 'days', ('tob',)),
+
+    # RECREATIONAL
+    ('summ_total_rx_opd_mg', 'mg', ('rx_opd',)),
+    ('summ_total_rx_sleep_mg', 'mg', ('rx_sleep',)),
+    ('summ_total_rx_mrelax_mg', 'mg', ('rx_mrelax',)),
+    ('summ_total_rx_nsaid_mg', 'mg', ('rx_nsaid',)),
+    ('summ_total_rx_nerv_mg', 'mg', ('rx_nerv',)),
+    ('summ_total_rx_adhd_mg', 'mg', ('rx_adhd',)),
+    ('summ_total_rx_other_mg', 'mg', ('rx_other',)),
+
+    ('summ_total_rx_opd_d', 'days', ('rx_opd',)),
+    ('summ_total_rx_sleep_d', 'days', ('rx_sleep',)),
+    ('summ_total_rx_mrelax_d', 'days', ('rx_mrelax',)),
+    ('summ_total_rx_nsaid_d', 'days', ('rx_nsaid',)),
+    ('summ_total_rx_nerv_d', 'days', ('rx_nerv',)),
+    ('summ_total_rx_adhd_d', 'days', ('rx_adhd',)),
+    ('summ_total_rx_other_d', 'days', ('rx_other',)),
+    ('summ_total_rx_all_d', 'days', ('rx',)),
+
+    # ILLEGAL
+    ('summ_total_illegal_all_d', 'days', ('illegal',)),
+)
+
+# the columns of get_transform_values, in order
+VALUE_COLUMNS = tuple(names[idx] for idx in range(MAX_DAYS) for names, read in DAY_FIELDS) + \
+                tuple(field for field, aggregate, keys in SUMMARY_FIELDS)
+
+DAY_SUFFIX = re.compile(r'_(d\d\d)$')
+UNKNOWN_ANSWERS = ('-9999', '-8888', '999', '----', 'Unknown')
+
+
+def summarize(transform):
+    index = SummaryIndex(transform)
+    return collections.OrderedDict(
+        (field, index.aggregate(aggregate, keys)) for field, aggregate, keys in SUMMARY_FIELDS
+    )
+
+
+class SummaryIndex(object):
+    """
+    Per-day columns of a transform indexed once by column name and day, so every summary can be computed without
+    rescanning the whole transform. Each aggregate gives the same result as the matching get_* helper above.
+    """
+
+    def __init__(self, transform):
+        self.days = []
+        self.columns = collections.OrderedDict()  # column name -> {day: value}
+        for k, v in transform.items():
+            match = DAY_SUFFIX.search(k)
+            if not match or any(x in k for x in ['pid', 'cohort']):
+                continue
+            day = match.group(1)
+            self.columns.setdefault(k[:match.start()], {})[day] = v
+            if day not in self.days:
+                self.days.append(day)
+        self._matches = {}
+        self._converted = {}
+        self._day_sets = {}
+        self._results = {}
+
+    def aggregate(self, aggregate, keys):
+        if (aggregate, keys) not in self._results:
+            method = {
+                'total': self.total,
+                'days': self.day_count,
+                'average': self.average,
+                'mg': self.mg,
+                'same_days': self.same_day_count,
+            }[aggregate]
+            self._results[(aggregate, keys)] = method(keys)
+        return self._results[(aggregate, keys)]
+
+    def matching_columns(self, key):
+        # columns a key selects, e.g. 'can' -> ['scan_flw_g', ..., 'ncan_other_names']
+        if key not in self._matches:
+            self._matches[key] = [c for c in self.columns if key in c]
+        return self._matches[key]
+
+    def converted(self, column, day):
+        if (column, day) not in self._converted:
+            self._converted[(column, day)] = value_converter(self.columns[column][day])
+        return self._converted[(column, day)]
+
+    def cells(self, key):
+        # (column, day, value) in the same order as iterating over the transform dict
+        columns = self.matching_columns(key)
+        for day in self.days:
+            for column in columns:
+                if day in self.columns[column]:
+                    yield column, day, self.columns[column][day]
+
+    def day_set(self, keys, unknown=False):
+        if (keys, unknown) not in self._day_sets:
+            days = set()
+            for key in keys:
+                for column, day, v in self.cells(key):
+                    # "if v" should eliminate answers of 0 or empty string
+                    if v and not (unknown and v in UNKNOWN_ANSWERS):
+                        days.add(day)
+            self._day_sets[(keys, unknown)] = days
+        return self._day_sets[(keys, unknown)]
+
+    def total(self, keys):
+        sum = 0.0
+        first_agg = True
+        empty = True
+        for key in keys:
+            for column, day, v in self.cells(key):
+                # exclude alc_other, cann_other, etc. Also exclude rx_all_names
+                if not v or any(x in column for x in ['other', 'names']):
+                    continue
+                value = self.converted(column, day)
+                if not value:
+                    continue
+                empty = False
+                try:
+                    if key == 'cann' or key == 'can' or key == 'cans':
+                        if not any(x in column for x in ['flwrthc', 'flwrcbd', 'dabthc', 'dabcbd']):
+                            sum = unknown_check(sum, value, first_agg)
+                    elif key == 'rx':
+                        if 'mg' not in column:
+                            sum = unknown_check(sum, value, first_agg)
+                    else:
+                        sum = unknown_check(sum, value, first_agg)
+                    first_agg = False
+                except:  # in some cases we have non-valid numbers...
+                    LOGGER.error('Failed to convert "{}"'.format(value), extra={
+                        'stack': True,
+                    })
+                    client.captureException()
+                    continue
+
+        # Don't want it filling in 0s if there was nothing to aggregate
+        if empty:
+            return ''
+        elif sum in [-9999, -8888, -8989]:
+            return str(int(sum))
+        else:
+            return str(sum)
+
+    def day_count(self, keys):
+        return len(self.day_set(keys))
+
+    def same_day_count(self, keys):
+        same_days = set(self.day_set(keys[-1:]))
+        for key in keys:
+            same_days &= self.day_set((key,))
+        return len(same_days)
+
+    def average(self, keys):
+        sum = self.aggregate('total', keys)
+        if sum == '':
+            return sum
+
+        day = len(self.day_set(keys, True))
+        if float(sum) in [-9999, -8888, -8989]:
+            return str(int(float(sum)))
+        elif day:
+            return str(round(float(sum) / float(day), 10))
+        else:
+            return '0.0'
+
+    def mg(self, keys):
+        mg_sum = 0.0
+        first_agg = True
+        daylies = set()
+        for key in keys:
+            pills = self.columns.get(key + '_pills', {})
+            mgpp = self.columns.get(key + '_mgpp', {})
+            for column, day, v in self.cells(key):
+                if day in daylies or 'names' in column:
+                    continue
+                daylies.add(day)
+                if pills.get(day) and mgpp.get(day):
+                    first_agg = False
+                    try:
+                        mg_sum += round(float(pills[day]) * float(mgpp[day]), 10)
+                    except:  # in some cases we have non-valid numbers...
+                        LOGGER.error('Failed to convert "{}"'.format(v), extra={
+                            'stack': True,
+                        })
+                        client.captureException()
+                        continue
+        # Don't want it filling in 0s if there was nothing to aggregate
+        if first_agg:
+            return ''
+        else:
+            return str(mg_sum)
+
+
+# everything build_values depends on. Stored transform values are only used while none of it changes, a change makes
+# them stale (see materialize_transforms)
+TRANSFORM_LOGIC = (
+    build_values, compile_day_fields, read_answer, get_answer, get_legacy_answer_key, value_converter, convert_value,
+    get_substance_flags, get_rx_names, get_illegal_names, get_all_others, summarize, SummaryIndex, unknown_check,
+    MAX_DAYS, DAY_COLUMNS, SUMMARY_FIELDS, SUBSTANCE_GROUPS, RX_NAMES, ILLEGAL_NAMES, LEGACY_UNITS, NON_NUMERIC,
+    DAY_SUFFIX, UNKNOWN_ANSWERS,
+)
+
+
+def describe(part):
+    # the same text in every process: sets are sorted and functions are described by their source, not their address
+    if isinstance(part, (tuple, list)):
+        return '(' + ', '.join(describe(p) for p in part) + ')'
+    if isinstance(part, (set, frozenset)):
+        return '{' + ', '.join(sorted(describe(p) for p in part)) + '}'
+    if hasattr(part, 'pattern'):
+        return repr(part.pattern)
+    if callable(part):
+        return inspect.getsource(part)
+    return repr(part)
+
+
+def get_transform_version():
+    return hashlib.sha256(describe(TRANSFORM_LOGIC).encode('utf-8')).hexdigest()[:16]
+
+
+TRANSFORM_VERSION = get_transform_version()
@@ -2,7 +2,7 @@ from django.conf.urls import url
 from django.contrib import admin
 from django.urls import include
 
-from tlfb.views import LoginView, MarkerDateView, CalendarView, ThankYouView, TimeoutView
+from tlfb.views import LoginView, MarkerDateView, CalendarView, DayEntryView, SchemaView, ThankYouView, TimeoutView
 from tlfb.wizards import SubstanceWizard
 
 urlpatterns = [
@@ -11,6 +11,9 @@ urlpatterns = [
     url(r'^step1_daterange/$', MarkerDateView.as_view(), name='step1'),
     url(r'^step2_calendar/$', CalendarView.as_view(), name='step2'),
     url(r'^step3_substances/$', SubstanceWizard.as_view(), name='step3'),
+    url(r'^step3_day/$', DayEntryView.as_view(), name='step3_day'),
+    url(r'^schema/$', SchemaView.as_view(), name='schema'),
+    url(r'^schema/(?P<version>[0-9a-f]+)/$', SchemaView.as_view(), name='schema_version'),
     url(r'^step4_thankyou/$', ThankYouView.as_view(), name='step4'),
     url(r'^timeout/$', TimeoutView.as_view(), name='timeout'),
 
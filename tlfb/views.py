@@ -1,23 +1,37 @@
 import collections
+import json
 import logging
 import random
 import dateutil.parser
 
 from datetime import timedelta
 from django.contrib import messages
-from django.http import HttpResponseRedirect
+from django.db import transaction
+from django.forms import BaseFormSet
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
 from django.urls import reverse_lazy, reverse
 from django.utils import timezone
-from django.views.generic import FormView, TemplateView
-
-from tlfb import tasks
-from tlfb.data.models import RoughData
-from tlfb.settings import USE_CELERY
+from django.utils.cache import patch_cache_control
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import etag
+from django.views.generic import FormView, TemplateView, View
+from raven.contrib.django.raven_compat.models import client
+
+from tlfb.data.drafts import (add_marker, create_days, delete_days, get_session_markers, has_markers,
+                              restore_markers, save_substances)
+from tlfb.data.facts import save_facts
+from tlfb.data.models import OutboxEntry, RoughData
+from tlfb.data.transforms import materialize
+from tlfb.schema import get_schema_json, get_schema_version, get_session_overrides
+from tlfb.settings import SINGLE_PAGE_ENTRY, UPLOAD_TO_REDCAP
 from tlfb.encrypttest import encrip, decrip
-from tlfb.forms import LoginForm, MarkerDateForm, TimeoutForm
-from tlfb.encrypt_data import get_encrypted_session, get_decrypted_session
+from tlfb.forms import CopyDayForm, LoginForm, MarkerDateForm, TimeoutForm
+from tlfb.encrypt_data import bump_revision, get_decrypted_session, get_session_snapshot
+from tlfb.wizards import SubmittedDay, collect_substances
 LOGGER = logging.getLogger(__name__)
 
+SCHEMA_MAX_AGE = 60 * 60 * 24 * 365  # seconds a versioned schema can be cached for
+
 
 class LoginView(FormView):
     form_class = LoginForm
@@ -50,11 +64,9 @@ class LoginView(FormView):
             except:
                 days = 14
 
-        markers = {}
+        dates = []
         for i in range(0, days):
-            date = timezone.localdate(timezone.now()) - timedelta(days=(i + offset))
-            markers[date.isoformat()] = {'markers': []}
-        self.request.session['markers'] = markers
+            dates.append(timezone.localdate(timezone.now()) - timedelta(days=(i + offset)))
 
         study_cohort = self.request.GET.get('cohort') or ''
         activate_study_cannabis = self.request.GET.get('with_study_cbs') or False
@@ -69,6 +81,9 @@ class LoginView(FormView):
         self.request.session['pid'] = f"{subid}-{timepoint}-{today.isoformat()}-" \
                                       f"{str(random_submission_number).zfill(4)}"
 
+        # the calendar itself is kept in the database (see tlfb.data.drafts), the session only identifies it
+        create_days(self.request.session['pid'], dates)
+
         self.request.session['offset'] = offset
         self.request.session['cohort'] = study_cohort
 
@@ -76,6 +91,7 @@ class LoginView(FormView):
         self.request.session['days'] = days
         self.request.session['prescription'] = keep_prescription
         self.request.session['study_removed'] = True if remove_label_study else False
+        bump_revision(self.request.session)
         return super(LoginView, self).form_valid(form)
 
 
@@ -85,49 +101,122 @@ class MarkerDateView(FormView):
 
     def form_valid(self, form):
         if 'add' in form.data:
-            markers = self.request.session.get('markers')
             date, event = form.get_marker()
 
-            if not markers.get(date.isoformat()):
-                # sometimes the JS widget lets you put in invalid info
-                return HttpResponseRedirect(reverse('step1'))
-
-            markers[date.isoformat()]['markers'].append(event)
-            self.request.session['markers'] = markers
+            # sometimes the JS widget lets you put in invalid info, those dates aren't on the calendar
+            add_marker(self.request.session.get('pid'), date, event)
+            bump_revision(self.request.session)
             return HttpResponseRedirect(reverse('step1'))
 
         elif 'done' in form.data:
             return HttpResponseRedirect(reverse('step2'))
 
     def get_context_data(self, **kwargs):
-        markers = self.request.session.get('markers')
+        markers = get_session_markers(self.request.session)
+        kwargs['encrypted_session'] = get_session_snapshot(self.request.session, markers)
 
         # for the template, convert to python dates
         markers = {dateutil.parser.parse(k): v for k, v in markers.items()}
         kwargs['markers'] = collections.OrderedDict(sorted(markers.items()))
-
-        kwargs['encrypted_session'] = get_encrypted_session(self.request.session)
         return super(MarkerDateView, self).get_context_data(**kwargs)
 
 
-class CalendarView(TemplateView):
+class CalendarView(FormView):
+    form_class = CopyDayForm
     template_name = 'step2_calendar.html'
+    success_url = reverse_lazy('step2')
+
+    def get_form_kwargs(self):
+        kwargs = super(CalendarView, self).get_form_kwargs()
+        kwargs['markers'] = self.get_markers()
+        return kwargs
+
+    def get_markers(self):
+        # the form and the calendar both need them
+        if not hasattr(self, 'markers'):
+            self.markers = get_session_markers(self.request.session)
+        return self.markers
+
+    def form_valid(self, form):
+        # fill every chosen day in one go instead of a wizard run per day
+        save_substances(self.request.session.get('pid'), form.cleaned_data['dates'], form.get_substances())
+        bump_revision(self.request.session)
+        messages.success(self.request, 'Copied the substances to {} days.'.format(len(form.cleaned_data['dates'])))
+        return super(CalendarView, self).form_valid(form)
 
     def get_context_data(self, **kwargs):
-        markers = self.request.session.get('markers')
+        markers = self.get_markers()
         kwargs['finished'] = True
-        for date, data in self.request.session.get('markers').items():
+        for date, data in markers.items():
             if not data.get('submitted'):
                 kwargs['finished'] = False
+        kwargs['encrypted_session'] = get_session_snapshot(self.request.session, markers)
 
         # for the template, convert to python dates
         markers = {dateutil.parser.parse(k): v for k, v in markers.items()}
         kwargs['markers'] = collections.OrderedDict(sorted(markers.items()))
 
-        kwargs['encrypted_session'] = get_encrypted_session(self.request.session)
+        kwargs['single_page_entry'] = SINGLE_PAGE_ENTRY
         return super(CalendarView, self).get_context_data(**kwargs)
 
 
+class DayEntryView(TemplateView):
+    """
+    Enters a whole day on one page instead of through the SubstanceWizard. The page renders the steps from the schema
+    in the browser and posts every answer at once as JSON, which is validated with the same forms as the wizard.
+    """
+    template_name = 'step3_day.html'
+
+    def get(self, request, *args, **kwargs):
+        if not request.GET.get('date'):
+            return HttpResponseRedirect(reverse('step2'))
+        return super(DayEntryView, self).get(request, *args, **kwargs)
+
+    def get_context_data(self, **kwargs):
+        kwargs['date'] = self.request.GET.get('date')
+        kwargs['schema_url'] = reverse('schema_version', args=[get_schema_version()])
+        kwargs['overrides'] = get_session_overrides(self.request.session)
+        return super(DayEntryView, self).get_context_data(**kwargs)
+
+    def post(self, request, *args, **kwargs):
+        try:
+            payload = json.loads(request.body.decode('utf-8'))
+            date = dateutil.parser.parse(payload['date']).date()
+            answers = dict(payload['steps'])
+        except (ValueError, KeyError, TypeError, OverflowError):
+            return JsonResponse({'error': 'Invalid submission'}, status=400)
+
+        day = SubmittedDay(request, answers)
+        steps = day.get_form_list()
+        forms = [day.get_form(step) for step in steps]
+        errors = {step: get_errors(form) for step, form in zip(steps, forms) if not form.is_valid()}
+        if errors:
+            return JsonResponse({'errors': errors}, status=400)
+
+        if not save_substances(request.session.get('pid'), [date], collect_substances(forms)):
+            return JsonResponse({'error': 'This day is not on your calendar'}, status=400)
+        bump_revision(request.session)
+        return JsonResponse({'redirect': reverse('step2')})
+
+
+@method_decorator(etag(lambda request, *args, **kwargs: '"{}"'.format(get_schema_version())), name='dispatch')
+class SchemaView(View):
+    """
+    The questionnaire schema (see tlfb.schema) as JSON. A versioned URL never changes, so it can be cached for good;
+    the unversioned URL always returns the current version and has to be revalidated with its ETag.
+    """
+    def get(self, request, version=None, *args, **kwargs):
+        if version and version != get_schema_version():
+            return HttpResponseRedirect(reverse('schema_version', args=[get_schema_version()]))
+
+        response = HttpResponse(get_schema_json(), content_type='application/json')
+        if version:
+            patch_cache_control(response, public=True, max_age=SCHEMA_MAX_AGE, immutable=True)
+        else:
+            patch_cache_control(response, public=True, no_cache=True)
+        return response
+
+
 class ThankYouView(TemplateView):
     template_name = 'step4_thankyou.html'
 
@@ -135,14 +224,17 @@ class ThankYouView(TemplateView):
         subid = self.request.session.get('subid')
         timepoint = self.request.session.get('timepoint')
         encrypted_cohort = self.request.session.get('cohort')
-        session_data = self.request.session.get('markers')
         pid = self.request.session.get("pid")
+        session_data = get_session_markers(self.request.session)
 
         # validate that all have been submitted
         for date, data in session_data.items():
             if not data.get('submitted'):
                 messages.error(request, 'You must complete the form for each day on the calendar.')
                 return HttpResponseRedirect(reverse('step2'))
+        if not session_data:
+            # already submitted, the calendar is deleted with the submission
+            return super(ThankYouView, self).get(request, *args, **kwargs)
 
         k = '9678365400123890'
         try:
@@ -151,21 +243,32 @@ class ThankYouView(TemplateView):
             logging.error(f"failed to decrypt {subid}")
 
         try:
-            rd = RoughData.objects.create(subid=subid,
-                                          timepoint=timepoint,
-                                          cohort=encrypted_cohort,
-                                          answers=session_data)
-
-            rd.save()
+            # the outbox entry is only written and the calendar only deleted if the submission is saved
+            with transaction.atomic():
+                rd = RoughData(subid=subid,
+                               timepoint=timepoint,
+                               cohort=encrypted_cohort,
+                               answers=session_data)
+                # transformed once here instead of on every export, see tlfb.data.transforms
+                materialize(rd)
+                rd.save()
+                if UPLOAD_TO_REDCAP:
+                    OutboxEntry.objects.create(roughdata=rd, pid=pid or '')
+                delete_days(pid)
         except:
             logging.error(f"subid: '{subid}'")
             logging.error(f"timepoint: '{timepoint}'")
             logging.error(f"encrypted_cohort: '{encrypted_cohort}'")
             logging.error(f"session_data: '{session_data}'")
+        else:
+            # the per-day facts are only derived from the submission, backfill_facts fills them in if this fails
+            try:
+                save_facts([rd])
+            except:
+                logging.error(f"failed to save the facts of submission {rd.pk}")
+                client.captureException()
 
-        # TODO: uncomment this line if you are also running celery and uploading data somewhere.
-        # attempt_export(self.request.session)
-
+        # with UPLOAD_TO_REDCAP submissions are uploaded from the outbox by the flush_outbox celery task or command
         return super(ThankYouView, self).get(request, *args, **kwargs)
 
 
@@ -181,26 +284,21 @@ class TimeoutView(FormView):
 
             try:
                 session_data = get_decrypted_session(form.cleaned_data["encrypted_session"])
+                markers = session_data.pop('markers', None)
                 for key, value in session_data.items():
                     self.request.session[key] = value
+                # the calendar outlives the session in the database, the copy from the browser is only needed if
+                # it's gone
+                if markers and not has_markers(self.request.session.get('pid')):
+                    restore_markers(self.request.session.get('pid'), markers)
+                bump_revision(self.request.session)
                 return HttpResponseRedirect(reverse('step1'))
             except:
                 return HttpResponseRedirect(reverse('login'))
 
 
-def attempt_export(session):
-    try:
-        if USE_CELERY:
-            tasks.submit.delay(subid=session.get('subid'),
-                               timepoint=session.get('timepoint'),
-                               cohort=session.get('cohort'),
-                               pid_number=session.get("pid"),
-                               data=session.get('markers'))
-        else:
-            tasks.redcap_upload(subid=session.get('subid'),
-                                timepoint=session.get('timepoint'),
-                                cohort=session.get('cohort'),
-                                pid_number=session.get("pid"),
-                                data=session.get('markers'))
-    except Exception as e:
-        logging.error(e)
+def get_errors(form):
+    if isinstance(form, BaseFormSet):
+        return {'forms': [get_errors(f) for f in form.forms],
+                '__all__': [error['message'] for error in form.non_form_errors().get_json_data()]}
+    return {field: [error['message'] for error in errors] for field, errors in form.errors.get_json_data().items()}
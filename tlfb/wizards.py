@@ -2,11 +2,14 @@ from collections import OrderedDict
 
 import dateutil.parser
 import six
+from django.conf import settings
 from django.forms import Form, BaseFormSet
 from django.http import HttpResponseRedirect
 from django.urls import reverse
 from formtools.wizard.views import SessionWizardView
 
+from tlfb.data.drafts import save_substances
+from tlfb.encrypt_data import bump_revision
 from tlfb.forms import *
 
 FORMS = [
@@ -107,8 +110,118 @@ FORMS = [
 ]
 
 
+def build_step_graph(form_list):
+    """
+    Maps every step to the step it drills down from (its show_condition_step) and orders the steps so that each one
+    comes after that parent. A step is only shown when its parent is, so the whole list resolves in one pass.
+    """
+    parents = OrderedDict((form_key, getattr(form_class, 'show_condition_step', ''))
+                          for form_key, form_class in form_list)
+    order = []
+
+    def visit(form_key):
+        if form_key in order:
+            return
+        if parents[form_key] in parents:
+            visit(parents[form_key])
+        order.append(form_key)
+
+    for form_key in parents:
+        visit(form_key)
+    return parents, order
+
+
+STEP_PARENTS, STEP_ORDER = build_step_graph(FORMS)
+
+
+def get_shown_steps(wizard, form_list):
+    """
+    The steps of form_list that are shown given the answers so far. wizard is anything with the request and
+    get_cleaned_data_for_step that the forms' show conditions use.
+    """
+    shown = {'': True}  # steps without a parent only depend on their own condition
+    for form_key in STEP_ORDER:
+        shown[form_key] = shown.get(STEP_PARENTS[form_key], False) and bool(form_list[form_key].show(wizard))
+
+    shown_steps = OrderedDict()
+    for form_key, form_class in six.iteritems(form_list):
+        if shown[form_key]:
+            shown_steps[form_key] = form_class
+    return shown_steps
+
+
+def get_step_kwargs(session, step):
+    if step == 'substance-drilldown':
+        return {'prescription': session.get('prescription'),'prescription2': session.get('prescription2'),'study_removed': session.get('study_removed')}
+    return {}
+
+
+def collect_substances(forms):
+    """
+    The answers of a day's validated forms, as they are stored in markers[date]['substances']
+    """
+    substances = {}
+    for form in forms:
+        if isinstance(form, DrilldownForm):  # skip drilldown forms
+            continue
+        if isinstance(form, Form):
+            substances.update(form.get_nonzero_answers())
+        if isinstance(form, BaseFormSet):
+            for idx, f in enumerate(form.forms):
+                substances.update(f.get_nonzero_answers(idx=idx))
+    return substances
+
+
+class SubmittedDay(object):
+    """
+    The answers to every step of a day posted at once from the single page entry, see views.DayEntryView. answers
+    maps each step to its field values, or to a list of them for formsets.
+    """
+    form_list = OrderedDict(FORMS)
+
+    def __init__(self, request, answers):
+        self.request = request
+        self.answers = dict(answers)
+        self.forms = {}
+
+    def get_form(self, step):
+        if step not in self.forms:
+            form_class = self.form_list[step]
+            data = self.answers.get(step) or {}
+            if issubclass(form_class, BaseFormSet):
+                entries = data if isinstance(data, list) else []
+                data = {'form-TOTAL_FORMS': len(entries), 'form-INITIAL_FORMS': 0}
+                for idx, entry in enumerate(entries):
+                    data.update({'form-{}-{}'.format(idx, field): value for field, value in entry.items()})
+            self.forms[step] = form_class(data=data, **get_step_kwargs(self.request.session, step))
+        return self.forms[step]
+
+    def get_cleaned_data_for_step(self, step):
+        if step in self.form_list and step in self.answers:
+            form = self.get_form(step)
+            if form.is_valid():
+                return form.cleaned_data
+        return None
+
+    def get_form_list(self):
+        # answers to steps that turn out to be hidden can't show other steps, the wizard would never have stored them
+        while True:
+            shown_steps = get_shown_steps(self, self.form_list)
+            hidden = [step for step in self.answers if step not in shown_steps]
+            if not hidden:
+                return shown_steps
+            for step in hidden:
+                del self.answers[step]
+
+
 class SubstanceWizard(SessionWizardView):
     form_list = FORMS
+    storage_name = settings.WIZARD_STORAGE
+
+    def dispatch(self, request, *args, **kwargs):
+        # cleaned data of every step, cached for this request (see get_cleaned_data_for_step)
+        self.cleaned_data_cache = {}
+        return super().dispatch(request, *args, **kwargs)
 
     def get(self, request, *args, **kwargs):
         if not request.GET.get('date'):
@@ -119,20 +232,9 @@ class SubstanceWizard(SessionWizardView):
         return ['step3_substanceform.html']
 
     def done(self, form_list, **kwargs):
-        substances = {}
-        data = self.request.session.get('markers')
-        date = dateutil.parser.parse(self.request.GET.get('date')).date().isoformat()
-        data[date]['submitted'] = True
-        for form in form_list:
-            if isinstance(form, DrilldownForm):  # skip drilldown forms
-                continue
-            if isinstance(form, Form):
-                substances.update(form.get_nonzero_answers())
-            if isinstance(form, BaseFormSet):
-                for idx, f in enumerate(form.forms):
-                    substances.update(f.get_nonzero_answers(idx=idx))
-            data[date]['substances'] = substances
-            self.request.session['markers'] = data
+        date = dateutil.parser.parse(self.request.GET.get('date')).date()
+        save_substances(self.request.session.get('pid'), [date], collect_substances(form_list))
+        bump_revision(self.request.session)
         return HttpResponseRedirect(reverse('step2'))
 
     def get_context_data(self, form, **kwargs):
@@ -143,13 +245,21 @@ class SubstanceWizard(SessionWizardView):
         """
         Slight modification of superclass definition
         """
-        form_list = OrderedDict()
-        for form_key, form_class in six.iteritems(self.form_list):
-            if form_class.show(self):
-                form_list[form_key] = form_class
-        return form_list
+        return get_shown_steps(self, self.form_list)
+
+    def get_cleaned_data_for_step(self, step):
+        # formtools calls get_form_list many times per request and every show condition revalidates its parent step,
+        # so each step is only validated once until its data changes
+        if step not in self.cleaned_data_cache:
+            self.cleaned_data_cache[step] = super().get_cleaned_data_for_step(step)
+        return self.cleaned_data_cache[step]
+
+    def process_step(self, form):
+        # the current step's data is about to be replaced
+        self.cleaned_data_cache = {}
+        return super().process_step(form)
 
     def get_form_kwargs(self, step=None):
         if step == 'substance-drilldown':
-            return {'prescription': self.request.session.get('prescription'),'prescription2': self.request.session.get('prescription2'),'study_removed': self.request.session.get('study_removed')}
+            return get_step_kwargs(self.request.session, step)
         return super(SubstanceWizard, self).get_form_kwargs(step=step)